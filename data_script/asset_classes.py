@@ -0,0 +1,41 @@
+import os
+
+from sources import in_folders, is_archive, list_archive_members, list_tree_files, split_member_path
+
+# Stooq folders holding each asset class, matched as in sources.in_folders. The class names are
+# also the names of their SUQL tables. A file belongs to the first class whose folders match.
+ASSET_CLASSES = {
+    "stocks": ["*stocks"],
+    "etfs": ["*etfs"],
+    "indices": ["*indices"],
+    "bonds": ["*bonds"],
+    "crypto": ["*crypto*"],
+}
+
+
+# Asset class of a file from its path relative to the bundle root, or None
+def asset_class_of(relative_path):
+    for asset_class, folders in ASSET_CLASSES.items():
+        if in_folders(relative_path, folders):
+            return asset_class
+    return None
+
+
+# Stooq files of the requested classes found under the roots (directories or zip archives,
+# e.g. the d_us_txt and d_world_txt bundles), as {class: file paths}. Classes without files
+# are left out.
+def discover_asset_classes(roots, classes):
+    grouped = {asset_class: [] for asset_class in classes}
+    for root in roots:
+        if is_archive(root):
+            paths = list_archive_members(root)
+            relative_paths = [split_member_path(path)[1] for path in paths]
+        else:
+            paths = list_tree_files(root)
+            relative_paths = [os.path.relpath(path, root).replace(os.sep, "/") for path in paths]
+
+        for path, relative_path in zip(paths, relative_paths):
+            asset_class = asset_class_of(relative_path)
+            if asset_class in grouped:
+                grouped[asset_class].append(path)
+    return {asset_class: paths for asset_class, paths in grouped.items() if paths}
@@ -0,0 +1,217 @@
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from bar_cache import load_cached_panel
+from metrics_engine import as_dates
+
+# Rebalance rules: never (buy and hold), at the last bar of every month, quarter or year, or every
+# N bars given as an integer
+REBALANCE_RULES = ["none", "monthly", "quarterly", "annual"]
+
+TRADING_DAYS = 252
+
+# Plans evaluated together, bounding the (plans x dates) matrices
+BLOCK_PLANS = 2048
+
+
+# Closes of the given tickers on the calendar of all their bars between start and end, as a
+# (dates x tickers) matrix carrying the last close forward over days a ticker did not trade and
+# NaN before its first bar. Tickers missing from the panel are NaN throughout.
+def close_matrix(panel, tickers, start=None, end=None):
+    row_of = {ticker: row for row, ticker in enumerate(panel.tickers)}
+    rows = np.array([row_of.get(ticker, -1) for ticker in tickers], dtype=np.int64)
+    present = np.flatnonzero(rows >= 0)
+
+    starts = panel.starts[rows[present]]
+    lengths = panel.lengths[rows[present]]
+    column = np.repeat(present, lengths)
+    index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    dates = as_dates(panel.columns["DATE"][index])
+    closes = np.asarray(panel.columns["CLOSE"][index], dtype=np.float64)
+
+    keep = np.ones(len(dates), dtype=bool)
+    if end is not None:
+        keep &= dates <= np.datetime64(end, "D")
+    # The last bar of each ticker before the start gives its price on the first date
+    opening = np.zeros(len(dates), dtype=bool)
+    if start is not None:
+        before = keep & (dates < np.datetime64(start, "D"))
+        keep &= ~before
+        opening = before & np.append(~before[1:] | (column[1:] != column[:-1]), True)
+
+    calendar = np.unique(dates[keep])
+    matrix = np.full((len(calendar), len(tickers)), np.nan)
+    if len(calendar) == 0:
+        return calendar, matrix
+    matrix[0, column[opening]] = closes[opening]
+    matrix[np.searchsorted(calendar, dates[keep]), column[keep]] = closes[keep]
+
+    # Forward fill along the dates
+    filled = np.where(np.isnan(matrix), 0, np.arange(len(calendar))[:, None])
+    np.maximum.accumulate(filled, axis=0, out=filled)
+    matrix = matrix[filled, np.arange(len(tickers))[None, :]]
+    return calendar, matrix
+
+
+# Row of the calendar closing each rebalance period, the first row being the initial investment
+def rebalance_rows(calendar, rule):
+    n_days = len(calendar)
+    if isinstance(rule, (int, np.integer)) or str(rule).isdigit():
+        step = max(int(rule), 1)
+        rows = np.arange(0, n_days, step)
+    elif rule == "none":
+        rows = np.array([0])
+    else:
+        unit = {"monthly": "M", "quarterly": "M", "annual": "Y"}[rule]
+        period = calendar.astype(f"datetime64[{unit}]").astype(np.int64)
+        if rule == "quarterly":
+            period //= 3
+        rows = np.concatenate([[0], np.flatnonzero(period[1:] != period[:-1])])
+    return np.unique(rows[rows < n_days])
+
+
+# Value of 1 invested in each plan on every date, as a (plans x dates) matrix. weights is
+# (plans x tickers), as fractions of the portfolio; the rest of the budget is held in cash, as is
+# the weight of a ticker before its first bar, which is invested at that bar's close. Between
+# rebalances the holdings drift with their prices; on a rebalance row they are reset to the
+# weights at that close.
+def equity_curves(closes, weights, rebalance):
+    n_days = len(closes)
+    known = ~np.isnan(closes)
+    growth = np.where(known, closes, 1.0)
+    # A period runs from the day after a rebalance to the next rebalance, included
+    period = np.zeros(n_days + 1, dtype=np.int64)
+    period[rebalance[1:] + 1] = 1
+    period = np.cumsum(period)[:n_days]
+    anchor = rebalance[period]
+
+    # Growth of every ticker since the last rebalance, or since its first bar when it started
+    # trading after the rebalance (its weight is held in cash until then)
+    first_bar = np.where(known.any(axis=0), known.argmax(axis=0), n_days)
+    bought = np.minimum(np.maximum(anchor[:, None], first_bar[None, :]), n_days - 1)
+    relative = np.where(known, growth / growth[bought, np.arange(closes.shape[1])], 1.0)
+    cash = 1.0 - weights.sum(axis=1, keepdims=True)
+    factors = weights @ relative.T + cash
+
+    # Value at each rebalance, compounding the factors of the periods before it
+    closing = factors[:, rebalance[1:]] if len(rebalance) > 1 else np.ones((len(weights), 0))
+    opening = np.concatenate([np.ones((len(weights), 1)), np.cumprod(closing, axis=1)], axis=1)
+    return opening[:, period] * factors
+
+
+# CAGR, annualized volatility, Sharpe ratio, max drawdown and total return of every equity curve.
+# Returns and drawdowns are fractions (0.25 for 25%); the drawdown is positive, unlike the percent
+# 1_year_max_drawdown indicator, hence its explicit name.
+def curve_metrics(calendar, curves, risk_free=0.0):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        daily = curves[:, 1:] / curves[:, :-1] - 1
+        years = (calendar[-1] - calendar[0]).astype(np.int64) / 365.25 if len(calendar) > 1 else 0.0
+        cagr = curves[:, -1] ** (1 / years) - 1 if years > 0 else np.full(len(curves), np.nan)
+        volatility = daily.std(axis=1, ddof=1) * np.sqrt(TRADING_DAYS)
+        sharpe = (daily.mean(axis=1) * TRADING_DAYS - risk_free) / volatility
+    drawdown = 1 - curves / np.maximum.accumulate(curves, axis=1)
+    return {
+        "total_return": curves[:, -1] - 1,
+        "cagr": cagr,
+        "volatility": volatility,
+        "sharpe": sharpe,
+        "max_drawdown_fraction": drawdown.max(axis=1),
+    }
+
+
+# Backtest every plan, a dict with "weights" ({ticker: weight}), an optional "rebalance" rule
+# and an optional "id". Plans are grouped by rule and evaluated BLOCK_PLANS at a time over the
+# closes of all their tickers. Returns the metrics of every plan and, with keep_curves, the
+# calendar and the equity curves in plan order.
+def backtest_plans(panel, plans, start=None, end=None, risk_free=0.0, keep_curves=False):
+    tickers = sorted({ticker for plan in plans for ticker in plan["weights"]})
+    column_of = {ticker: i for i, ticker in enumerate(tickers)}
+    calendar, closes = close_matrix(panel, tickers, start, end)
+    if len(calendar) == 0:
+        raise ValueError(f"No bars of the plans' tickers between {start} and {end}")
+    known = ~np.isnan(closes)
+    missing = [ticker for ticker, traded in zip(tickers, known.any(axis=0)) if not traded]
+    if missing:
+        print(f"No bars for {len(missing)} tickers, held as cash: {', '.join(missing[:10])}")
+    late = [ticker for ticker, traded, opening in zip(tickers, known.any(axis=0), known[0]) if traded and not opening]
+    if late:
+        print(f"{len(late)} tickers start trading after {calendar[0]}, held as cash until their first bar: {', '.join(late[:10])}")
+
+    rules = np.array([str(plan.get("rebalance", "none")) for plan in plans])
+    metrics = {}
+    curves = np.empty((len(plans), len(calendar))) if keep_curves else None
+    for rule in np.unique(rules):
+        if rule not in REBALANCE_RULES and not rule.isdigit():
+            raise ValueError(f"Unknown rebalance rule {rule!r}, expected one of {REBALANCE_RULES} or a number of bars")
+        rebalance = rebalance_rows(calendar, rule)
+        members = np.flatnonzero(rules == rule)
+        for first in range(0, len(members), BLOCK_PLANS):
+            block = members[first:first + BLOCK_PLANS]
+            weights = np.zeros((len(block), len(tickers)))
+            for row, plan_index in enumerate(block):
+                for ticker, weight in plans[plan_index]["weights"].items():
+                    weights[row, column_of[ticker]] += weight
+            block_curves = equity_curves(closes, weights, rebalance)
+            for name, values in curve_metrics(calendar, block_curves, risk_free).items():
+                metrics.setdefault(name, np.full(len(plans), np.nan))[block] = values
+            if keep_curves:
+                curves[block] = block_curves
+
+    result = pd.DataFrame({"id": [plan.get("id", i) for i, plan in enumerate(plans)], "rebalance": rules})
+    for name, values in metrics.items():
+        result[name] = values
+    if len(calendar):
+        result.insert(2, "start", calendar[0])
+        result.insert(3, "end", calendar[-1])
+    return (result, calendar, curves) if keep_curves else result
+
+
+# Plans of a JSON file holding a list of plans, or of a JSON Lines file with one plan per line
+def read_plans(path):
+    with open(path, "r") as plans_file:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in plans_file if line.strip()]
+        return json.load(plans_file)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default="bar_cache",
+        help="Bar cache written by us_stock_processing.py --cache_dir.",
+    )
+    parser.add_argument(
+        "--plans",
+        type=str,
+        required=True,
+        help='JSON (list) or JSON Lines file of plans: {"id": ..., "weights": {"QQQ.US": 0.4, ...}, "rebalance": "monthly"}.',
+    )
+    parser.add_argument("--start", type=str, default=None, help="First date of the backtest (YYYY-MM-DD).")
+    parser.add_argument("--end", type=str, default=None, help="Last date of the backtest (YYYY-MM-DD).")
+    parser.add_argument("--risk_free", type=float, default=0.0, help="Annual risk-free rate of the Sharpe ratio.")
+    parser.add_argument("--output_file", type=str, default="backtest.csv", help="Metrics of every plan.")
+    parser.add_argument(
+        "--curves_file",
+        type=str,
+        default=None,
+        help="Also write the equity curves (dates x plans) to this CSV file.",
+    )
+    args = parser.parse_args()
+
+    panel = load_cached_panel(args.cache_dir)
+    plans = read_plans(args.plans)
+    result = backtest_plans(panel, plans, args.start, args.end, args.risk_free, keep_curves=args.curves_file is not None)
+    if args.curves_file is not None:
+        result, calendar, curves = result
+        pd.DataFrame(curves.T, index=pd.Index(calendar, name="DATE"), columns=result["id"]).to_csv(args.curves_file)
+    result.to_csv(args.output_file, index=False)
+    print(f"Backtested {len(plans)} plans, metrics written to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import json
+import os
+
+import numpy as np
+
+from metrics_engine import Panel
+from sources import source_stat
+
+# Columns kept in the cache, one .npy file each
+CACHE_COLUMNS = ("DATE", "OPEN", "HIGH", "LOW", "CLOSE", "VOL")
+
+# Bump when the cleaning rules change so that stale caches are rebuilt
+CACHE_VERSION = 1
+
+INDEX_FILE = "index.json"
+
+
+# Size and modification time identifying the content of a source file or archive member
+def file_signature(file_path):
+    return list(source_stat(file_path))
+
+
+def read_index(cache_dir):
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "r") as index_file:
+        index = json.load(index_file)
+    if index.get("version") != CACHE_VERSION:
+        return None
+    return index
+
+
+# Memory-map the cached panel. Column arrays are read-only views on the .npy files.
+def load_cached_panel(cache_dir):
+    def load(name):
+        return np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r")
+
+    return Panel(
+        tickers=np.asarray(load("TICKER")).astype(object),
+        starts=np.asarray(load("starts")),
+        lengths=np.asarray(load("lengths")),
+        columns={name: load(name) for name in CACHE_COLUMNS},
+    )
+
+
+# Write an array next to its final name and move it into place, so that existing memory maps
+# of the old file stay valid
+def save_array(cache_dir, name, array):
+    path = os.path.join(cache_dir, f"{name}.npy")
+    with open(path + ".tmp", "wb") as array_file:
+        np.save(array_file, array)
+    os.replace(path + ".tmp", path)
+
+
+# Write the panel and the source file index. The index is written last, so an interrupted
+# write leaves a cache that fails validation instead of one that looks valid.
+def save_cached_panel(cache_dir, panel, files):
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    save_array(cache_dir, "TICKER", panel.tickers.astype(str))
+    save_array(cache_dir, "starts", panel.starts)
+    save_array(cache_dir, "lengths", panel.lengths)
+    for name in CACHE_COLUMNS:
+        save_array(cache_dir, name, np.asarray(panel.columns[name]))
+
+    with open(index_path, "w") as index_file:
+        json.dump({"version": CACHE_VERSION, "files": files}, index_file)
+
+
+# Panel of all files, parsing only those whose size or mtime changed since the cache was
+# written. read_frame(file_path) returns the cleaned frame of a file, or None when the file
+# is skipped; the changed files are parsed with map_frames(read_frame, paths), e.g. the map of a
+# process pool. Returns a memory-mapped panel and the number of files that were parsed.
+def cached_panel(cache_dir, file_paths, read_frame, map_frames=map):
+    index = read_index(cache_dir)
+    cached_files = {}
+    if index is not None:
+        cached_files = {entry["path"]: entry for entry in index["files"]}
+
+    signatures = [file_signature(file_path) for file_path in file_paths]
+    hits = [
+        file_path in cached_files and cached_files[file_path]["signature"] == signature
+        for file_path, signature in zip(file_paths, signatures)
+    ]
+    if all(hits) and len(cached_files) == len(file_paths):
+        return load_cached_panel(cache_dir), 0
+
+    cached = load_cached_panel(cache_dir) if index is not None else None
+    misses = [file_path for file_path, hit in zip(file_paths, hits) if not hit]
+    parsed_frames = dict(zip(misses, map_frames(read_frame, misses)))
+
+    # Collect the bars of every file, from the cache when possible
+    tickers = []
+    pieces = {name: [] for name in CACHE_COLUMNS}
+    files = []
+    for file_path, signature, hit in zip(file_paths, signatures, hits):
+        entry = {"path": file_path, "signature": signature, "row": None}
+        files.append(entry)
+
+        if hit:
+            row = cached_files[file_path]["row"]
+            if row is None:
+                continue
+            start = cached.starts[row]
+            stop = start + cached.lengths[row]
+            ticker = cached.tickers[row]
+            columns = {name: cached.columns[name][start:stop] for name in CACHE_COLUMNS}
+        else:
+            df = parsed_frames.pop(file_path)
+            if df is None:
+                continue
+            ticker = df["TICKER"].iloc[0]
+            columns = {name: df[name].to_numpy() for name in CACHE_COLUMNS}
+
+        entry["row"] = len(tickers)
+        tickers.append(ticker)
+        for name in CACHE_COLUMNS:
+            pieces[name].append(columns[name])
+
+    lengths = np.array([len(piece) for piece in pieces["CLOSE"]], dtype=np.int64)
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    if len(lengths) > 1:
+        starts[1:] = np.cumsum(lengths)[:-1]
+    data = {}
+    for name in CACHE_COLUMNS:
+        dtype = "datetime64[D]" if name == "DATE" else np.float64
+        data[name] = np.concatenate(pieces[name]).astype(dtype) if tickers else np.array([], dtype=dtype)
+
+    panel = Panel(tickers=np.array(tickers, dtype=object), starts=starts, lengths=lengths, columns=data)
+    save_cached_panel(cache_dir, panel, files)
+    return load_cached_panel(cache_dir), len(misses)
@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics_engine import build_panel, panel_state, summarize_state
+from us_stock_processing import (
+    STOOQ_COLUMNS,
+    calculate_summary_metrics,
+    clean_stooq_frame,
+    list_stooq_files,
+    read_stooq_file,
+)
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "us_stock_processing.py")
+
+STOOQ_HEADER = "<TICKER>,<PER>,<DATE>,<TIME>,<OPEN>,<HIGH>,<LOW>,<CLOSE>,<VOL>,<OPENINT>\n"
+
+# Modes run by default, each as a separate us_stock_processing.py process
+MODES = ["serial", "parallel", "cached_cold", "cached_warm", "stream", "compact", "incremental"]
+
+# Tolerances of the comparison with the reference implementation. Compact mode rounds the bars
+# to float32, so its values are compared to that precision.
+RTOL = 1e-9
+COMPACT_RTOL = 1e-3
+
+
+# Write `tickers` synthetic stooq files of random-walk bars, each ending on the same business day
+# with between a tenth of and the full `bars` history
+def generate_stooq_files(output_dir, tickers, bars, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    calendar = np.arange(np.datetime64("2000-01-03"), np.datetime64("2000-01-03") + bars * 2)
+    calendar = calendar[np.is_busday(calendar)][:bars]
+    day_strings = np.char.replace(calendar.astype(str), "-", "")
+
+    for i in range(tickers):
+        length = int(rng.integers(max(5, bars // 10), bars + 1))
+        closes = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, length)))
+        spread = np.abs(rng.normal(0, 0.01, length))
+        df = pd.DataFrame({
+            "TICKER": f"SYN{i:05d}.US",
+            "PER": "D",
+            "DATE": day_strings[-length:],
+            "TIME": "000000",
+            "OPEN": closes * (1 + rng.normal(0, 0.005, length)),
+            "HIGH": closes * (1 + spread),
+            "LOW": closes * (1 - spread),
+            "CLOSE": closes,
+            "VOL": rng.integers(1_000, 5_000_000, length),
+            "OPENINT": 0,
+        })
+        with open(os.path.join(output_dir, f"syn{i:05d}.us.txt"), "w") as f:
+            f.write(STOOQ_HEADER)
+            df.to_csv(f, header=False, index=False, float_format="%.4f")
+
+
+# Append one bar after the last bar of every file, as a nightly stooq update would
+def append_bar(file_paths, seed=1):
+    rng = np.random.default_rng(seed)
+    for file_path in file_paths:
+        with open(file_path, "rb") as f:
+            f.seek(max(0, os.path.getsize(file_path) - 512))
+            last = f.read().splitlines()[-1].decode().split(",")
+        date = np.busday_offset(np.datetime64(f"{last[2][:4]}-{last[2][4:6]}-{last[2][6:]}"), 1, roll="forward")
+        close = float(last[7]) * (1 + rng.normal(0, 0.02))
+        last[2] = str(date).replace("-", "")
+        last[4:8] = [f"{close:.4f}"] * 4
+        with open(file_path, "a") as f:
+            f.write(",".join(last) + "\n")
+
+
+# Time the stages of a serial in-process run: reading the text, cleaning it, building the panel,
+# computing the metrics and writing the summary
+def stage_timings(file_paths, output_file):
+    timings = dict.fromkeys(["parse", "clean", "panel", "metrics", "write"], 0.0)
+
+    frames = []
+    for file_path in file_paths:
+        start = time.perf_counter()
+        raw = pd.read_csv(file_path, names=STOOQ_COLUMNS)
+        timings["parse"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        df = clean_stooq_frame(raw)
+        timings["clean"] += time.perf_counter() - start
+        if len(df) >= 5:
+            frames.append(df)
+
+    start = time.perf_counter()
+    panel = build_panel(frames)
+    timings["panel"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    summary = summarize_state(panel_state(panel))
+    timings["metrics"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    summary.to_csv(output_file, index=False)
+    timings["write"] = time.perf_counter() - start
+    return timings
+
+
+# Run us_stock_processing.py once, returning its wall time and the peak memory it reported
+def run_pipeline(arguments):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, SCRIPT, "--report_memory"] + arguments, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"us_stock_processing.py {' '.join(arguments)} failed:\n{result.stderr}")
+    match = re.search(r"Peak memory: (\d+) MB \(largest worker: (\d+) MB\)", result.stdout)
+    return elapsed, int(match.group(1)), int(match.group(2))
+
+
+# Summary rows of the reference per-ticker implementation for a sample of the files
+def reference_summary(file_paths, sample, seed=0):
+    rng = np.random.default_rng(seed)
+    if sample < len(file_paths):
+        file_paths = [file_paths[i] for i in sorted(rng.choice(len(file_paths), sample, replace=False))]
+    rows = []
+    for file_path in file_paths:
+        df = read_stooq_file(file_path)
+        if len(df) >= 5:
+            rows.append(calculate_summary_metrics(df))
+    return pd.DataFrame(rows)
+
+
+# Largest relative difference between the reference rows and the same tickers of a summary, or
+# None when tickers are missing or NaN patterns differ
+def compare_with_reference(summary, reference, rtol):
+    summary = summary.set_index("TICKER")
+    if not reference["TICKER"].isin(summary.index).all():
+        return None
+    worst = 0.0
+    for column in reference.columns[1:]:
+        expected = reference[column].to_numpy(np.float64)
+        actual = summary.loc[reference["TICKER"], column].to_numpy(np.float64)
+        if not np.allclose(actual, expected, rtol=rtol, atol=rtol * 1e-3, equal_nan=True):
+            return None
+        with np.errstate(divide="ignore", invalid="ignore"):
+            difference = np.abs(actual - expected) / np.maximum(np.abs(expected), 1e-12)
+        worst = max(worst, float(np.nanmax(difference, initial=0.0)))
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", type=int, default=500, help="Number of synthetic tickers.")
+    parser.add_argument("--bars", type=int, default=2520, help="Longest history in bars (10 years by default).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Workers of the parallel mode.")
+    parser.add_argument(
+        "--modes",
+        type=str,
+        default=",".join(MODES),
+        help=f"Comma-separated modes to run. Available: {', '.join(MODES)}.",
+    )
+    parser.add_argument(
+        "--check_tickers",
+        type=int,
+        default=200,
+        help="Number of tickers compared with the reference per-ticker implementation.",
+    )
+    parser.add_argument("--work_dir", type=str, default=None, help="Where to generate the data (a temporary directory by default).")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    modes = [mode for mode in args.modes.split(",") if mode]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"unknown modes {unknown}")
+    # The incremental mode appends bars to the files, so it runs last
+    modes = sorted(modes, key=MODES.index)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="stooq_benchmark_")
+    data_dir = os.path.join(work_dir, "data")
+    try:
+        start = time.perf_counter()
+        generate_stooq_files(data_dir, args.tickers, args.bars, args.seed)
+        file_paths = list_stooq_files(data_dir)
+        print(f"Generated {args.tickers} tickers x up to {args.bars} bars in {time.perf_counter() - start:.1f} s")
+
+        results = {"tickers": args.tickers, "bars": args.bars, "workers": args.workers, "modes": {}}
+        results["stages"] = stage_timings(file_paths, os.path.join(work_dir, "stages.csv"))
+        print("Stages (serial, in process): " + ", ".join(f"{name} {seconds:.2f} s" for name, seconds in results["stages"].items()))
+
+        reference = reference_summary(file_paths, args.check_tickers, args.seed)
+        failures = []
+        for mode in modes:
+            output_file = os.path.join(work_dir, f"{mode}.csv")
+            arguments = ["--data_dir", data_dir, "--output_file", output_file,
+                         "--state_file", os.path.join(work_dir, f"{mode}.npz")]
+            if mode == "parallel":
+                arguments += ["--workers", str(args.workers)]
+            elif mode.startswith("cached"):
+                arguments += ["--cache_dir", os.path.join(work_dir, "bar_cache")]
+            elif mode == "stream":
+                arguments += ["--stream"]
+            elif mode == "compact":
+                arguments += ["--compact"]
+            elif mode == "incremental":
+                # Seed the state with a full run, then time the update after one new bar per file
+                run_pipeline(arguments)
+                append_bar(file_paths, args.seed + 1)
+                reference = reference_summary(file_paths, args.check_tickers, args.seed)
+                arguments += ["--incremental"]
+            if mode == "cached_warm" and "cached_cold" not in modes:
+                run_pipeline(arguments)
+
+            seconds, peak_mb, worker_mb = run_pipeline(arguments)
+            error = compare_with_reference(
+                pd.read_csv(output_file), reference, COMPACT_RTOL if mode == "compact" else RTOL
+            )
+            if error is None:
+                failures.append(mode)
+            results["modes"][mode] = {
+                "seconds": seconds,
+                "peak_mb": peak_mb,
+                "worker_peak_mb": worker_mb,
+                "matches_reference": error is not None,
+                "max_relative_error": error,
+            }
+            status = "ok" if error is not None else "MISMATCH"
+            print(f"{mode:>12}: {seconds:6.2f} s, peak {peak_mb} MB (workers {worker_mb} MB), reference {status}")
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=4)
+    if failures:
+        sys.exit(f"Results differ from the reference implementation in modes: {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    main()
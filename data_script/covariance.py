@@ -0,0 +1,161 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from bar_cache import load_cached_panel
+from metrics_engine import tail_matrix
+from rolling_kernel import daily_returns, trailing_dates
+
+# Lookbacks in trading days for which matrices are produced by default
+DEFAULT_LOOKBACKS = [63, 126, 252]
+
+# Share of the calendar a ticker must have traded on to be included in a lookback
+MIN_COVERAGE = 0.9
+
+INDEX_FILE = "index.json"
+
+
+# Trading calendar of the last `lookback` return dates of the universe. Dates on which fewer
+# than half of the most active day's tickers traded (holidays on single exchanges, stray
+# weekend bars) are left out.
+def trading_calendar(dates, lookback):
+    valid = dates[~np.isnat(dates)]
+    calendar, counts = np.unique(valid, return_counts=True)
+    calendar = calendar[counts >= 0.5 * counts.max()]
+    return calendar[-lookback:]
+
+
+# Daily returns of every ticker aligned on a common calendar. Returns the calendar, the
+# included ticker rows and a (dates x tickers) matrix with NaN where a ticker did not trade.
+def aligned_returns(panel, lookback, min_coverage=MIN_COVERAGE):
+    # A margin of extra bars covers tickers that skipped some calendar days
+    width = int(min(panel.lengths.max(), lookback * 2))
+    returns = tail_matrix(panel, daily_returns(panel, panel.columns["CLOSE"]), width)
+    dates = trailing_dates(panel.columns["DATE"], panel.starts, panel.lengths, width)
+
+    calendar = trading_calendar(dates.ravel(), lookback)
+    position = np.clip(np.searchsorted(calendar, dates), 0, len(calendar) - 1)
+    on_calendar = (calendar[position] == dates) & ~np.isnan(returns)
+
+    matrix = np.full((len(calendar), len(panel)), np.nan)
+    ticker_index = np.broadcast_to(np.arange(len(panel))[:, None], dates.shape)
+    matrix[position[on_calendar], ticker_index[on_calendar]] = returns[on_calendar]
+
+    coverage = np.sum(~np.isnan(matrix), axis=0) / max(len(calendar), 1)
+    rows = np.flatnonzero(coverage >= min_coverage)
+    return calendar, rows, matrix[:, rows]
+
+
+# Ledoit-Wolf shrinkage of the sample covariance towards a scaled identity.
+# X is (observations x assets) with NaN for missing values, which are treated as the asset's
+# mean return. Returns the shrunk covariance and the shrinkage intensity.
+def ledoit_wolf(X):
+    X = X - np.nanmean(X, axis=0)
+    X = np.where(np.isnan(X), 0.0, X)
+    n_obs, n_assets = X.shape
+
+    sample = X.T @ X / n_obs
+    mu = np.trace(sample) / n_assets
+    target_distance = np.sum((sample - mu * np.eye(n_assets)) ** 2) / n_assets
+
+    # Dispersion of the single-observation outer products around the sample covariance,
+    # using sum_t ||x_t x_t' - S||^2 = sum_t ||x_t||^4 - T ||S||^2
+    row_norms = np.sum(X * X, axis=1)
+    dispersion = (np.sum(row_norms ** 2) - n_obs * np.sum(sample ** 2)) / (n_assets * n_obs ** 2)
+    dispersion = min(max(dispersion, 0.0), target_distance)
+
+    shrinkage = dispersion / target_distance if target_distance > 0 else 0.0
+    covariance = (1 - shrinkage) * sample
+    covariance[np.diag_indices(n_assets)] += shrinkage * mu
+    return covariance, shrinkage
+
+
+def correlation_from_covariance(covariance):
+    std = np.sqrt(np.diag(covariance))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlation = covariance / np.outer(std, std)
+    correlation[~np.isfinite(correlation)] = 0.0
+    np.fill_diagonal(correlation, 1.0)
+    return correlation
+
+
+# Compute the daily covariance and correlation matrices and mean daily returns of each
+# lookback and store them as float32 .npy files, with the ticker order of every lookback in
+# index.json. The aligned daily returns (NaN where a ticker did not trade) are stored as well,
+# for resampling, with their calendar in index.json so that returns of several directories can be
+# aligned by date.
+def write_covariances(panel, output_dir, lookbacks=DEFAULT_LOOKBACKS, min_coverage=MIN_COVERAGE):
+    os.makedirs(output_dir, exist_ok=True)
+    index = {}
+    for lookback in lookbacks:
+        calendar, rows, returns = aligned_returns(panel, lookback, min_coverage)
+        covariance, shrinkage = ledoit_wolf(returns)
+
+        np.save(os.path.join(output_dir, f"cov_{lookback}.npy"), covariance.astype(np.float32))
+        np.save(
+            os.path.join(output_dir, f"corr_{lookback}.npy"),
+            correlation_from_covariance(covariance).astype(np.float32),
+        )
+        np.save(os.path.join(output_dir, f"mean_{lookback}.npy"), np.nanmean(returns, axis=0).astype(np.float32))
+        np.save(os.path.join(output_dir, f"returns_{lookback}.npy"), returns.astype(np.float32))
+        index[str(lookback)] = {
+            "tickers": [str(ticker) for ticker in panel.tickers[rows]],
+            "start": str(calendar[0]) if len(calendar) else None,
+            "end": str(calendar[-1]) if len(calendar) else None,
+            "observations": int(len(calendar)),
+            "dates": [str(date) for date in calendar],
+            "shrinkage": float(shrinkage),
+        }
+        print(f"Lookback {lookback}: {len(rows)} tickers, shrinkage {shrinkage:.3f}")
+
+    with open(os.path.join(output_dir, INDEX_FILE), "w") as index_file:
+        json.dump(index, index_file, indent=4)
+
+
+# Tickers, mean daily returns and memory-mapped covariance and correlation matrices of one lookback
+def load_covariance(output_dir, lookback):
+    with open(os.path.join(output_dir, INDEX_FILE), "r") as index_file:
+        entry = json.load(index_file)[str(lookback)]
+    mean = np.load(os.path.join(output_dir, f"mean_{lookback}.npy"))
+    covariance = np.load(os.path.join(output_dir, f"cov_{lookback}.npy"), mmap_mode="r")
+    correlation = np.load(os.path.join(output_dir, f"corr_{lookback}.npy"), mmap_mode="r")
+    return entry["tickers"], mean, covariance, correlation
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default="bar_cache",
+        help="Bar cache written by us_stock_processing.py --cache_dir.",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="covariance",
+        help="Where to write the covariance and correlation matrices.",
+    )
+    parser.add_argument(
+        "--lookbacks",
+        type=str,
+        default=",".join(str(lookback) for lookback in DEFAULT_LOOKBACKS),
+        help="Comma-separated lookbacks in trading days.",
+    )
+    parser.add_argument(
+        "--min_coverage",
+        type=float,
+        default=MIN_COVERAGE,
+        help="Share of the calendar a ticker must have traded on to be included.",
+    )
+    args = parser.parse_args()
+
+    panel = load_cached_panel(args.cache_dir)
+    lookbacks = [int(lookback) for lookback in args.lookbacks.split(",")]
+    write_covariances(panel, args.output_dir, lookbacks, args.min_coverage)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import io
+
+import numpy as np
+import psycopg2
+from psycopg2 import sql
+
+# Metrics that the SUQL queries filter and sort on, indexed with B-trees
+DEFAULT_INDEXED_COLUMNS = [
+    "ticker",
+    "5_day_return",
+    "10_day_return",
+    "1_month_return",
+    "6_month_return",
+    "1_year_return",
+    "5_day_volatility",
+    "10_day_volatility",
+    "1_month_volatility",
+    "6_month_volatility",
+    "1_year_volatility",
+    "rsi",
+]
+
+
+def connect(database, user, password, host="127.0.0.1", port="5432"):
+    return psycopg2.connect(
+        database=database,
+        user=user,
+        password=password,
+        host=host,
+        port=port,
+        options="-c client_encoding=UTF8",
+    )
+
+
+# Column names as they appear in the SUQL tables (lowercase, e.g. RSI -> rsi)
+def table_column(name):
+    return name.lower()
+
+
+# Replace `table_name` with the summary DataFrame in one transaction.
+#
+# The rows are streamed with COPY FROM STDIN into a staging table with DOUBLE PRECISION metric
+# columns, indexed and analyzed, and then swapped in place of the live table. Readers see
+# either the old or the new table, never a partially loaded one.
+def load_metrics(
+    summary_df,
+    table_name,
+    database,
+    user,
+    password,
+    host="127.0.0.1",
+    port="5432",
+    indexed_columns=None,
+    grant_select_to=("select_user",),
+):
+    if indexed_columns is None:
+        indexed_columns = DEFAULT_INDEXED_COLUMNS
+
+    df = summary_df.copy()
+    df.columns = [table_column(name) for name in df.columns]
+    metric_columns = [name for name in df.columns if name != "ticker"]
+
+    # Infinite values (e.g. returns from a zero close) are stored as NULL
+    df[metric_columns] = df[metric_columns].astype(np.float64).replace([np.inf, -np.inf], np.nan)
+    df.insert(0, "_id", np.arange(1, len(df) + 1))
+
+    staging_name = f"{table_name}_staging"
+    table = sql.Identifier(table_name)
+    staging = sql.Identifier(staging_name)
+
+    column_definitions = [
+        sql.SQL("_id INT PRIMARY KEY"),
+        sql.SQL("ticker CHARACTER VARYING(32)"),
+    ] + [
+        sql.SQL("{} DOUBLE PRECISION").format(sql.Identifier(name)) for name in metric_columns
+    ]
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    conn = connect(database, user, password, host=host, port=port)
+    try:
+        with conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(staging))
+                cursor.execute(
+                    sql.SQL("CREATE TABLE {} ({})").format(staging, sql.SQL(", ").join(column_definitions))
+                )
+                cursor.copy_expert(
+                    sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+                        staging, sql.SQL(", ").join(sql.Identifier(name) for name in df.columns)
+                    ).as_string(conn),
+                    buffer,
+                )
+
+                # Indexes are named after the staging table and renamed once it is swapped in
+                indexes = [name for name in indexed_columns if name in df.columns]
+                for name in indexes:
+                    cursor.execute(
+                        sql.SQL("CREATE INDEX {} ON {} ({})").format(
+                            sql.Identifier(f"{staging_name}_{name}_idx"), staging, sql.Identifier(name)
+                        )
+                    )
+                cursor.execute(sql.SQL("ANALYZE {}").format(staging))
+
+                cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(table))
+                cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(staging, table))
+                cursor.execute(
+                    sql.SQL("ALTER TABLE {} RENAME CONSTRAINT {} TO {}").format(
+                        table, sql.Identifier(f"{staging_name}_pkey"), sql.Identifier(f"{table_name}_pkey")
+                    )
+                )
+                for name in indexes:
+                    cursor.execute(
+                        sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                            sql.Identifier(f"{staging_name}_{name}_idx"),
+                            sql.Identifier(f"{table_name}_{name}_idx"),
+                        )
+                    )
+                for role in grant_select_to:
+                    cursor.execute(
+                        sql.SQL("GRANT SELECT ON {} TO {}").format(table, sql.Identifier(role))
+                    )
+    finally:
+        conn.close()
+
+    print(f"Loaded {len(df)} rows into {table_name}")
@@ -0,0 +1,213 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from metrics_engine import as_dates, tail_matrix
+from rolling_kernel import daily_returns, trailing_dates, trailing_mean, trailing_std
+
+# Trading days per year, used to annualize ratios
+TRADING_DAYS = 252
+
+
+# An indicator computed over a whole panel. `compute(context)` returns a dict mapping each name
+# in `columns` to one value per ticker. Tickers with fewer than `min_bars` bars get NaN.
+@dataclass
+class Indicator:
+    name: str
+    columns: list
+    min_bars: int
+    compute: object
+    needs_benchmark: bool = False
+
+
+INDICATORS = {}
+
+
+# Register the decorated function as an indicator
+def indicator(name, columns, min_bars, needs_benchmark=False):
+    def register(compute):
+        INDICATORS[name] = Indicator(name, list(columns), min_bars, compute, needs_benchmark)
+        return compute
+    return register
+
+
+# Intermediate series shared by the indicators of one panel. Every series, tail matrix and
+# trailing statistic is computed on first use and then reused by the other indicators.
+class IndicatorContext:
+    def __init__(self, panel, benchmark=None):
+        self.panel = panel
+        self.benchmark = benchmark
+        self.cache = {}
+
+    def memo(self, key, compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    def series(self, name):
+        return self.memo(("series", name), lambda: SERIES[name](self))
+
+    # Last `width` values of a series per ticker, right-aligned and NaN-padded
+    def tail(self, name, width):
+        return self.memo(("tail", name, width), lambda: tail_matrix(self.panel, self.series(name), width))
+
+    # Dates of the bars in tail(name, width), NaT where padded
+    def tail_dates(self, width):
+        return self.memo(
+            ("tail_dates", width),
+            lambda: trailing_dates(self.series("DATE"), self.panel.starts, self.panel.lengths, width),
+        )
+
+    def mean(self, name, window):
+        return self.memo(
+            ("mean", name, window), lambda: trailing_mean(self.panel, self.series(name), [window])[:, 0]
+        )
+
+    def std(self, name, window):
+        return self.memo(
+            ("std", name, window), lambda: trailing_std(self.panel, self.series(name), [window])[:, 0]
+        )
+
+    def last(self, name):
+        ends = self.panel.starts + self.panel.lengths
+        return self.series(name)[ends - 1]
+
+
+# Derived per-bar series available to the indicators, next to the raw panel columns
+SERIES = {
+    "CLOSE": lambda context: np.asarray(context.panel.columns["CLOSE"], dtype=np.float64),
+    "HIGH": lambda context: np.asarray(context.panel.columns["HIGH"], dtype=np.float64),
+    "LOW": lambda context: np.asarray(context.panel.columns["LOW"], dtype=np.float64),
+    "DATE": lambda context: as_dates(context.panel.columns["DATE"]),
+    "returns": lambda context: daily_returns(context.panel, context.series("CLOSE")),
+    "log_returns": lambda context: np.log1p(context.series("returns")),
+    "downside_returns": lambda context: np.minimum(context.series("returns"), 0.0),
+    "true_range": lambda context: true_range(context),
+}
+
+
+# High-low range extended to the previous close, as used by the ATR
+def true_range(context):
+    close = context.series("CLOSE")
+    previous_close = np.full(len(close), np.nan)
+    previous_close[1:] = close[:-1]
+    previous_close[context.panel.starts] = np.nan
+
+    high = context.series("HIGH")
+    low = context.series("LOW")
+    ranges = np.stack([high - low, np.abs(high - previous_close), np.abs(low - previous_close)])
+    return np.nanmax(ranges, axis=0)
+
+
+@indicator("bollinger", ["bollinger_upper", "bollinger_lower", "bollinger_pct_b"], min_bars=20)
+def bollinger_bands(context, window=20, width=2):
+    middle = context.mean("CLOSE", window)
+    spread = width * context.std("CLOSE", window)
+    upper = middle + spread
+    lower = middle - spread
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct_b = (context.last("CLOSE") - lower) / (upper - lower)
+    return {"bollinger_upper": upper, "bollinger_lower": lower, "bollinger_pct_b": pct_b}
+
+
+@indicator("atr", ["atr_14"], min_bars=15)
+def average_true_range(context, window=14):
+    return {"atr_14": context.mean("true_range", window)}
+
+
+@indicator("sharpe", ["1_year_sharpe"], min_bars=TRADING_DAYS)
+def sharpe_ratio(context):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = context.mean("returns", TRADING_DAYS) / context.std("returns", TRADING_DAYS)
+    return {"1_year_sharpe": ratio * np.sqrt(TRADING_DAYS)}
+
+
+@indicator("sortino", ["1_year_sortino"], min_bars=TRADING_DAYS)
+def sortino_ratio(context):
+    downside = context.tail("downside_returns", TRADING_DAYS)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        downside_deviation = np.sqrt(np.nanmean(downside * downside, axis=1))
+        ratio = context.mean("returns", TRADING_DAYS) / downside_deviation
+    return {"1_year_sortino": ratio * np.sqrt(TRADING_DAYS)}
+
+
+@indicator("max_drawdown", ["1_year_max_drawdown"], min_bars=TRADING_DAYS)
+def max_drawdown(context):
+    closes = context.tail("CLOSE", TRADING_DAYS)
+    peaks = np.fmax.accumulate(closes, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        drawdowns = closes / peaks - 1
+    return {"1_year_max_drawdown": np.nanmin(drawdowns, axis=1) * 100}
+
+
+@indicator("52_week_range", ["52_week_high_distance", "52_week_low_distance"], min_bars=TRADING_DAYS)
+def high_low_distance(context):
+    high = np.nanmax(context.tail("HIGH", TRADING_DAYS), axis=1)
+    low = np.nanmin(context.tail("LOW", TRADING_DAYS), axis=1)
+    close = context.last("CLOSE")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "52_week_high_distance": (close / high - 1) * 100,
+            "52_week_low_distance": (close / low - 1) * 100,
+        }
+
+
+@indicator("beta", ["1_year_beta"], min_bars=TRADING_DAYS, needs_benchmark=True)
+def beta(context):
+    returns = context.tail("returns", TRADING_DAYS)
+    dates = context.tail_dates(TRADING_DAYS)
+
+    # Benchmark return on the same date as each ticker return, NaN when it did not trade
+    benchmark_dates, market_returns = context.benchmark
+    position = np.clip(np.searchsorted(benchmark_dates, dates), 0, len(benchmark_dates) - 1)
+    matched = benchmark_dates[position] == dates
+    market = np.where(matched, market_returns[position], np.nan)
+
+    both = ~np.isnan(returns) & ~np.isnan(market)
+    counts = both.sum(axis=1)
+    x = np.where(both, market, 0.0)
+    y = np.where(both, returns, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_mean = x.sum(axis=1) / counts
+        y_mean = y.sum(axis=1) / counts
+        x_dev = np.where(both, x - x_mean[:, None], 0.0)
+        y_dev = np.where(both, y - y_mean[:, None], 0.0)
+        value = (x_dev * y_dev).sum(axis=1) / (x_dev * x_dev).sum(axis=1)
+    return {"1_year_beta": np.where(counts > 1, value, np.nan)}
+
+
+# Dates and daily returns of a benchmark series (e.g. an index), for the beta indicator
+def benchmark_returns(dates, closes):
+    dates = np.asarray(dates).astype("datetime64[D]")
+    closes = np.asarray(closes, dtype=np.float64)
+    returns = np.full(len(closes), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns[1:] = closes[1:] / closes[:-1] - 1
+    return dates, returns
+
+
+# Columns of the requested indicators for every ticker of the panel, in registry order.
+# `names` selects indicators from INDICATORS; benchmark is required by those that need one.
+def compute_indicators(panel, names, benchmark=None):
+    unknown = [name for name in names if name not in INDICATORS]
+    if unknown:
+        raise ValueError(f"Unknown indicators {unknown}, available: {list(INDICATORS)}")
+
+    context = IndicatorContext(panel, benchmark)
+    columns = {}
+    for name, spec in INDICATORS.items():
+        if name not in names:
+            continue
+        if spec.needs_benchmark and benchmark is None:
+            raise ValueError(f"Indicator '{name}' needs a benchmark series")
+
+        if len(panel) == 0:
+            values = {column: np.array([]) for column in spec.columns}
+        else:
+            values = spec.compute(context)
+        enough = panel.lengths >= spec.min_bars
+        for column in spec.columns:
+            columns[column] = np.where(enough, values[column], np.nan)
+
+    return pd.DataFrame(columns, index=pd.RangeIndex(len(panel)))
@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+
+from sources import open_source, source_stat
+
+# Bytes read at a time while hashing
+READ_SIZE = 1 << 20
+
+
+# Record of every source file the pipeline processed: size, mtime, content hash, the ticker it
+# holds and the date of its last processed bar, keyed by path
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(manifest, path):
+    with open(path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(path + ".tmp", path)
+
+
+# SHA-1 of the first `prefix_size` bytes of a file and of the whole file, in one read
+def file_digests(file_path, prefix_size=0):
+    digest = hashlib.sha1()
+    prefix_digest = None
+    remaining = prefix_size
+    with open_source(file_path) as f:
+        while remaining > 0:
+            chunk = f.read(min(READ_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+        prefix_digest = digest.hexdigest()
+        for chunk in iter(lambda: f.read(READ_SIZE), b""):
+            digest.update(chunk)
+    return prefix_digest, digest.hexdigest()
+
+
+# Compare the files with the manifest. Each file is classified as
+#   "unchanged": same size and mtime, or same content (not read or parsed again)
+#   "appended":  the old content is an unchanged prefix, so only new bars need reading
+#   "rewritten": earlier content changed (e.g. split adjustments), reprocess the whole file
+#   "new":       not in the manifest
+# Returns {path: (status, record)} with the record to store for the file once processed, and
+# the manifest entries of files that disappeared.
+def compare_with_manifest(manifest, file_paths):
+    changes = {}
+    for file_path in file_paths:
+        size, mtime_ns = source_stat(file_path)
+        record = {"size": size, "mtime_ns": mtime_ns}
+        entry = manifest.get(file_path)
+
+        if entry is not None and entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+            changes[file_path] = ("unchanged", dict(entry))
+            continue
+
+        if entry is None or size < entry["size"]:
+            _, record["sha1"] = file_digests(file_path)
+            changes[file_path] = ("new" if entry is None else "rewritten", record)
+            continue
+
+        prefix_digest, record["sha1"] = file_digests(file_path, entry["size"])
+        if prefix_digest != entry["sha1"]:
+            status = "rewritten"
+        elif size == entry["size"]:
+            # Touched without a content change
+            status = "unchanged"
+            record = dict(entry, mtime_ns=mtime_ns)
+        else:
+            status = "appended"
+        changes[file_path] = (status, record)
+
+    removed = {path: entry for path, entry in manifest.items() if path not in changes}
+    return changes, removed
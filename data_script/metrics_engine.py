@@ -0,0 +1,290 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# Horizons reported in the summary table, as (column prefix, trading days)
+HORIZONS = [
+    ("5_day", 5),
+    ("10_day", 10),
+    ("1_month", 21),   # approx. 21 trading days
+    ("6_month", 126),  # approx. 126 trading days
+    ("1_year", 252),   # approx. 252 trading days
+]
+
+# Number of trailing bars fed into the EMA recursions. Older bars carry a weight of at
+# most (25/27)^1000 ~ 1e-34 in EMA_26, so the latest MACD values match a full-history pass.
+EMA_LOOKBACK = 1000
+
+# Enough trailing bars for the longest horizon plus the return that opens it
+STATE_WIDTH = max(days for _, days in HORIZONS) + 1
+
+# EMA spans used for MACD and its signal line
+MACD_SPANS = (12, 26, 9)
+
+# Column order of the summary table, identical to the per-ticker implementation
+SUMMARY_COLUMNS = ["TICKER"] + [
+    f"{prefix}_{metric}"
+    for prefix, _ in HORIZONS
+    for metric in ("avg_close", "volatility", "avg_volume", "return")
+] + ["RSI", "MACD", "Signal_Line"]
+
+
+# All tickers of a universe stored back to back in flat column arrays.
+# Bars of ticker i live in columns[name][starts[i]:starts[i] + lengths[i]], sorted by date.
+@dataclass
+class Panel:
+    tickers: np.ndarray
+    starts: np.ndarray
+    lengths: np.ndarray
+    columns: dict
+
+    def __len__(self):
+        return len(self.tickers)
+
+
+# Dates of a DATE column as datetime64[D], whether stored as dates or as int32 day numbers
+def as_dates(values):
+    return np.asarray(values).astype("datetime64[D]")
+
+
+# Dates as int32 day numbers since 1970-01-01, the DATE dtype of compact panels
+def day_numbers(values):
+    values = np.asarray(values)
+    if values.dtype == np.int32:
+        return values
+    return values.astype("datetime64[D]").astype(np.int32)
+
+
+# Build a panel from cleaned per-ticker DataFrames (each already sorted by DATE).
+# A compact panel stores prices and volumes as float32 and dates as int32 day numbers, half the
+# memory of the default float64/datetime64 columns. The metrics are still computed in float64.
+def build_panel(frames, columns=("DATE", "OPEN", "HIGH", "LOW", "CLOSE", "VOL"), compact=False):
+    lengths = np.array([len(df) for df in frames], dtype=np.int64)
+    starts = np.zeros(len(frames), dtype=np.int64)
+    if len(frames) > 1:
+        starts[1:] = np.cumsum(lengths)[:-1]
+
+    tickers = np.array([df["TICKER"].iloc[0] for df in frames], dtype=object)
+    data = {}
+    for name in columns:
+        if frames:
+            data[name] = np.concatenate([df[name].to_numpy() for df in frames])
+        else:
+            data[name] = np.array([])
+        if name != "DATE":
+            data[name] = data[name].astype(np.float32 if compact else np.float64, copy=False)
+        elif compact:
+            data[name] = day_numbers(data[name])
+        else:
+            data[name] = as_dates(data[name])
+
+    return Panel(tickers=tickers, starts=starts, lengths=lengths, columns=data)
+
+
+# Gather the last `width` values of every ticker (or of the tickers selected by rows) into a
+# right-aligned matrix padded with NaN
+def tail_matrix(panel, values, width, rows=slice(None)):
+    starts = panel.starts[rows]
+    ends = starts + panel.lengths[rows]
+    index = ends[:, None] - width + np.arange(width)[None, :]
+    valid = index >= starts[:, None]
+    matrix = values[np.where(valid, index, 0)].astype(np.float64)
+    matrix[~valid] = np.nan
+    return matrix
+
+
+# Recursive EMA (pandas adjust=False) along the rows of a right-aligned matrix.
+# Each row starts its recursion at its first non-NaN value.
+def ema_matrix(matrix, span):
+    alpha = 2 / (span + 1)
+    out = np.empty_like(matrix)
+    prev = matrix[:, 0].copy()
+    out[:, 0] = prev
+    for j in range(1, matrix.shape[1]):
+        x = matrix[:, j]
+        prev = np.where(np.isnan(prev), x, (1 - alpha) * prev + alpha * x)
+        out[:, j] = prev
+    return out
+
+
+# Per-ticker state needed to produce the summary table: the last STATE_WIDTH closes and
+# volumes (right-aligned, NaN-padded), the number of bars seen and the final EMA values.
+# A state can be advanced with new bars without revisiting the full history.
+@dataclass
+class RollingState:
+    tickers: np.ndarray
+    last_dates: np.ndarray
+    counts: np.ndarray
+    closes: np.ndarray
+    volumes: np.ndarray
+    ema_short: np.ndarray
+    ema_long: np.ndarray
+    signal: np.ndarray
+
+    def __len__(self):
+        return len(self.tickers)
+
+
+STATE_FIELDS = list(RollingState.__dataclass_fields__)
+
+
+# Rolling state of every ticker in the panel, computed from its full history
+def panel_state(panel):
+    if len(panel) == 0:
+        return empty_state()
+
+    close = panel.columns["CLOSE"]
+    ends = panel.starts + panel.lengths
+
+    short_period, long_period, signal_period = MACD_SPANS
+    width = int(min(EMA_LOOKBACK, panel.lengths.max()))
+    closes = tail_matrix(panel, close, width)
+    ema_short = ema_matrix(closes, short_period)
+    ema_long = ema_matrix(closes, long_period)
+    signal = ema_matrix(ema_short - ema_long, signal_period)
+
+    return RollingState(
+        tickers=panel.tickers,
+        last_dates=as_dates(panel.columns["DATE"][ends - 1]),
+        counts=panel.lengths.copy(),
+        closes=tail_matrix(panel, close, STATE_WIDTH),
+        volumes=tail_matrix(panel, panel.columns["VOL"], STATE_WIDTH),
+        ema_short=ema_short[:, -1],
+        ema_long=ema_long[:, -1],
+        signal=signal[:, -1],
+    )
+
+
+def empty_state():
+    return RollingState(
+        tickers=np.array([], dtype=object),
+        last_dates=np.array([], dtype="datetime64[D]"),
+        counts=np.array([], dtype=np.int64),
+        closes=np.empty((0, STATE_WIDTH)),
+        volumes=np.empty((0, STATE_WIDTH)),
+        ema_short=np.array([]),
+        ema_long=np.array([]),
+        signal=np.array([]),
+    )
+
+
+# Rows of the state at the given positions, in that order
+def select_state(state, rows):
+    return RollingState(**{name: getattr(state, name)[rows] for name in STATE_FIELDS})
+
+
+# Stack several states into one, preserving their order
+def concat_states(states):
+    states = [state for state in states if len(state) > 0]
+    if not states:
+        return empty_state()
+    return RollingState(**{
+        name: np.concatenate([getattr(state, name) for state in states])
+        for name in STATE_FIELDS
+    })
+
+
+# Append the bars of `panel` (all dated after each ticker's last_dates) to the state, in place.
+# Every ticker of the panel must already be present in the state.
+def advance_state(state, panel):
+    if len(panel) == 0:
+        return state
+
+    row_of = {ticker: row for row, ticker in enumerate(state.tickers)}
+    missing = [ticker for ticker in panel.tickers if ticker not in row_of]
+    if missing:
+        raise ValueError(f"Tickers missing from the rolling state: {missing}")
+    rows = np.array([row_of[ticker] for ticker in panel.tickers], dtype=np.int64)
+
+    alphas = [2 / (span + 1) for span in MACD_SPANS]
+    close = panel.columns["CLOSE"]
+    volume = panel.columns["VOL"]
+    dates = as_dates(panel.columns["DATE"])
+
+    # One step per new bar, vectorized over the tickers that have that many new bars
+    for j in range(int(panel.lengths.max())):
+        active = panel.lengths > j
+        r = rows[active]
+        index = panel.starts[active] + j
+        x = close[index]
+
+        state.closes[r] = np.column_stack([state.closes[r, 1:], x])
+        state.volumes[r] = np.column_stack([state.volumes[r, 1:], volume[index]])
+        state.ema_short[r] = (1 - alphas[0]) * state.ema_short[r] + alphas[0] * x
+        state.ema_long[r] = (1 - alphas[1]) * state.ema_long[r] + alphas[1] * x
+        macd = state.ema_short[r] - state.ema_long[r]
+        state.signal[r] = (1 - alphas[2]) * state.signal[r] + alphas[2] * macd
+        state.counts[r] += 1
+        state.last_dates[r] = dates[index]
+
+    return state
+
+
+def save_state(state, path):
+    arrays = {name: getattr(state, name) for name in STATE_FIELDS}
+    arrays["tickers"] = state.tickers.astype(str)
+    np.savez(path, **arrays)
+
+
+def load_state(path):
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {name: data[name] for name in STATE_FIELDS}
+    arrays["tickers"] = arrays["tickers"].astype(object)
+    return RollingState(**arrays)
+
+
+# Latest RSI per ticker from its trailing closes, using the same simple rolling averages as
+# calculate_rsi. The first bar of a ticker counts as a zero change.
+def state_rsi(closes, period=14):
+    window = closes[:, -(period + 1):]
+    delta = np.diff(window, axis=1)
+    first_bar = np.isnan(window[:, :-1]) & ~np.isnan(window[:, 1:])
+    delta[first_bar] = 0
+
+    gain = np.where(delta > 0, delta, np.where(np.isnan(delta), np.nan, 0.0))
+    loss = np.where(delta < 0, -delta, np.where(np.isnan(delta), np.nan, 0.0))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rs = np.nanmean(gain, axis=1) / np.nanmean(loss, axis=1)
+        return 100 - (100 / (1 + rs))
+
+
+# Summary table of every ticker in the state, identical to calculate_summary_metrics
+def summarize_state(state):
+    if len(state) == 0:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    closes = state.closes
+    volumes = state.volumes
+
+    summary = {"TICKER": state.tickers}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rets = closes[:, 1:] / closes[:, :-1] - 1
+
+        for prefix, days in HORIZONS:
+            enough = state.counts >= days
+            window_rets = rets[:, -days:]
+            counts = np.sum(~np.isnan(window_rets), axis=1)
+            volatility = np.full(len(state), np.nan)
+            has_spread = enough & (counts > 1)
+            volatility[has_spread] = np.nanstd(window_rets[has_spread], axis=1, ddof=1)
+
+            summary[f"{prefix}_avg_close"] = np.where(enough, closes[:, -days:].mean(axis=1), np.nan)
+            summary[f"{prefix}_volatility"] = volatility
+            summary[f"{prefix}_avg_volume"] = np.where(enough, volumes[:, -days:].mean(axis=1), np.nan)
+            summary[f"{prefix}_return"] = np.where(
+                enough, (closes[:, -1] / closes[:, -days] - 1) * 100, np.nan
+            )
+
+    summary["RSI"] = state_rsi(closes)
+    summary["MACD"] = state.ema_short - state.ema_long
+    summary["Signal_Line"] = state.signal
+
+    return pd.DataFrame(summary, columns=SUMMARY_COLUMNS)
+
+
+# Summary metrics for every ticker of the panel in one vectorized pass.
+# Produces the same table as calling calculate_summary_metrics once per ticker.
+def calculate_panel_metrics(panel):
+    return summarize_state(panel_state(panel))
@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+
+from metrics_engine import Panel, as_dates
+
+# Bit flags set on the bars of a panel by screen_panel
+FLAGS = {
+    "bad_price": 1,      # a non-positive or missing open, high, low or close
+    "jump": 2,           # a daily log return far outside the ticker's usual range (e.g. a split)
+    "spike": 4,          # a jump reverted on the next bar, i.e. a single bad tick
+    "stale": 8,          # part of a run of STALE_RUN or more identical closes
+    "zero_volume": 16,   # part of a run of ZERO_VOLUME_RUN or more bars without volume
+    "gap": 32,           # first bar after more than MAX_GAP_DAYS business days without bars
+    "volume_spike": 64,  # volume above VOLUME_SPIKE times the ticker's median volume
+}
+
+# Flagged bars that screen_panel(repair=True) removes before the metrics are computed
+REPAIRED_FLAGS = FLAGS["bad_price"] | FLAGS["spike"]
+
+# |log return| / robust scale of the ticker's log returns above which a bar is a jump
+JUMP_Z = 10.0
+
+# Shortest run of identical closes flagged as stale
+STALE_RUN = 5
+
+# Shortest run of zero-volume bars flagged
+ZERO_VOLUME_RUN = 5
+
+# Longest stretch of business days without bars that is not reported as a gap
+MAX_GAP_DAYS = 5
+
+# Multiple of the median volume above which a bar is a volume spike
+VOLUME_SPIKE = 50.0
+
+# Scale of a normal distribution relative to its median absolute deviation
+MAD_SCALE = 1.4826
+
+
+# Median of non-negative `values` within each ticker of the panel, ignoring NaN (NaN for empty
+# tickers). Computed in float32, ample for a robust scale: the float32 bits of a non-negative
+# number sort like the number, so one integer sort of (ticker << 32 | bits) orders every ticker.
+def segment_median(values, owner, n_tickers):
+    values = np.where(np.isnan(values), np.nan, values).astype(np.float32)
+    keys = np.sort((owner.astype(np.int64) << 32) | values.view(np.int32).astype(np.int64))
+    sorted_values = (keys & 0xFFFFFFFF).astype(np.int32).view(np.float32)
+
+    valid = np.bincount(owner, weights=~np.isnan(values), minlength=n_tickers).astype(np.int64)
+    starts = np.zeros(n_tickers, dtype=np.int64)
+    starts[1:] = np.cumsum(np.bincount(owner, minlength=n_tickers))[:-1]
+    if len(sorted_values) == 0:
+        return np.full(n_tickers, np.nan)
+
+    # NaN sorts last within each ticker, so the valid values come first
+    last = len(sorted_values) - 1
+    low = np.minimum(starts + np.maximum(valid - 1, 0) // 2, last)
+    high = np.minimum(starts + np.maximum(valid, 1) // 2, last)
+    median = (sorted_values[low].astype(np.float64) + sorted_values[high]) / 2
+    return np.where(valid > 0, median, np.nan)
+
+
+# Length of the run of equal `keys` each bar belongs to, runs being cut at ticker boundaries
+def run_lengths(keys, first):
+    new_run = first.copy()
+    new_run[1:] |= keys[1:] != keys[:-1]
+    run_id = np.cumsum(new_run) - 1
+    return np.bincount(run_id)[run_id]
+
+
+# Quality flags of every bar of the panel, as a uint8 array of FLAGS bits
+def quality_flags(panel):
+    n_bars = len(panel.columns["CLOSE"])
+    flags = np.zeros(n_bars, dtype=np.uint8)
+    if n_bars == 0:
+        return flags
+
+    owner = np.repeat(np.arange(len(panel)), panel.lengths)
+    first = np.zeros(n_bars, dtype=bool)
+    first[panel.starts[panel.lengths > 0]] = True
+
+    prices = np.stack([np.asarray(panel.columns[name], dtype=np.float64) for name in ("OPEN", "HIGH", "LOW", "CLOSE")])
+    bad_price = ~(prices > 0).all(axis=0)
+    flags[bad_price] |= FLAGS["bad_price"]
+
+    close = np.where(bad_price, np.nan, prices[3])
+    log_returns = np.full(n_bars, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_returns[1:] = np.log(close[1:] / close[:-1])
+    log_returns[first] = np.nan
+
+    # Robust scale of the daily moves, so that the outliers themselves do not inflate it
+    scale = MAD_SCALE * segment_median(np.abs(log_returns), owner, len(panel))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.abs(log_returns) / scale[owner]
+    jump = z > JUMP_Z
+    flags[jump] |= FLAGS["jump"]
+
+    # A jump whose next bar moves back by a comparable amount is a bad tick, not a new level
+    reverted = np.zeros(n_bars, dtype=bool)
+    reverted[:-1] = (
+        jump[:-1] & jump[1:] & ~first[1:]
+        & (np.sign(log_returns[:-1]) != np.sign(log_returns[1:]))
+        & (np.abs(log_returns[:-1] + log_returns[1:]) < 0.5 * np.abs(log_returns[:-1]))
+    )
+    flags[reverted] |= FLAGS["spike"]
+
+    stale = run_lengths(prices[3], first) >= STALE_RUN
+    flags[stale & ~bad_price] |= FLAGS["stale"]
+
+    volume = np.asarray(panel.columns["VOL"], dtype=np.float64)
+    no_volume = volume == 0
+    flags[no_volume & (run_lengths(no_volume, first) >= ZERO_VOLUME_RUN)] |= FLAGS["zero_volume"]
+
+    median_volume = segment_median(np.where(volume > 0, volume, np.nan), owner, len(panel))
+    flags[volume > VOLUME_SPIKE * median_volume[owner]] |= FLAGS["volume_spike"]
+
+    dates = as_dates(panel.columns["DATE"])
+    gap = np.zeros(n_bars, dtype=bool)
+    gap[1:] = np.busday_count(dates[:-1], dates[1:]) > MAX_GAP_DAYS
+    flags[gap & ~first] |= FLAGS["gap"]
+
+    return flags
+
+
+# Panel holding only the bars where keep is True, without tickers left with fewer than
+# min_bars bars
+def filter_panel(panel, keep, min_bars=5):
+    owner = np.repeat(np.arange(len(panel)), panel.lengths)
+    lengths = np.bincount(owner, weights=keep, minlength=len(panel)).astype(np.int64)
+    kept_tickers = lengths >= min_bars
+    keep = keep & kept_tickers[owner]
+
+    lengths = lengths[kept_tickers]
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    if len(lengths) > 1:
+        starts[1:] = np.cumsum(lengths)[:-1]
+    return Panel(
+        tickers=panel.tickers[kept_tickers],
+        starts=starts,
+        lengths=lengths,
+        columns={name: np.asarray(values)[keep] for name, values in panel.columns.items()},
+    )
+
+
+# Per-ticker count of bars carrying each flag, and of the bars removed by the repair
+def quality_report(panel, flags, removed):
+    owner = np.repeat(np.arange(len(panel)), panel.lengths)
+    report = {"TICKER": panel.tickers, "bars": panel.lengths}
+    for name, bit in FLAGS.items():
+        report[name] = np.bincount(owner, weights=(flags & bit) > 0, minlength=len(panel)).astype(np.int64)
+    report["removed"] = np.bincount(owner, weights=removed, minlength=len(panel)).astype(np.int64)
+    return pd.DataFrame(report)
+
+
+# Screen every bar of the panel in one vectorized pass. Returns the panel to compute the metrics
+# on and the quality report of its tickers. With repair=True, bars with a bad price or a
+# reverted spike are removed (along with tickers left with fewer than 5 bars); the other flags
+# are only reported.
+def screen_panel(panel, repair=False):
+    flags = quality_flags(panel)
+    removed = np.zeros(len(flags), dtype=bool)
+    if repair:
+        removed = (flags & REPAIRED_FLAGS) > 0
+    report = quality_report(panel, flags, removed)
+    if repair and removed.any():
+        panel = filter_panel(panel, ~removed)
+    return panel, report
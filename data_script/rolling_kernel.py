@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+from metrics_engine import tail_matrix
+
+# Trailing-window statistics over a Panel, for any set of windows.
+#
+# The last max(windows) values of each ticker are summed once into cumulative sums running
+# backwards from the latest bar (of values, squares and counts), after which the sum over the
+# last k bars is a single lookup, i.e. O(1) per ticker and window. The sums are taken per
+# ticker, over values centred on their trailing mean, so that their precision does not depend
+# on the size of the universe or on how far prices drifted over the ticker's history.
+
+# Tickers processed together, bounding the size of the intermediate matrices
+BLOCK_ROWS = 4096
+
+
+# Sums of (x - m), (x - m)^2 and the number of values over the last k bars of every ticker,
+# for each k in windows, where m is the mean of the ticker's last max(windows) values. NaN
+# values are skipped, as in pandas; a window containing an infinite value is flagged in
+# `poisoned`.
+def trailing_sums(panel, values, windows):
+    values = np.asarray(values, dtype=np.float64)
+    windows = np.asarray(windows, dtype=np.int64)
+    width = int(windows.max())
+    columns = windows - 1
+
+    shape = (len(panel), len(windows))
+    sums = np.empty(shape)
+    squares = np.empty(shape)
+    counts = np.empty(shape)
+    poisoned = np.empty(shape, dtype=bool)
+    shift = np.empty(len(panel))
+
+    for first in range(0, len(panel), BLOCK_ROWS):
+        rows = slice(first, first + BLOCK_ROWS)
+        block = tail_matrix(panel, values, width, rows)
+
+        # Newest bar first, so that column j of a cumulative sum covers the last j + 1 bars
+        block = block[:, ::-1]
+        present = ~np.isnan(block)
+        infinite = np.isinf(block)
+        finite = present & ~infinite
+        clean = np.where(finite, block, 0.0)
+
+        finite_counts = finite.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            shift[rows] = np.where(finite_counts > 0, clean.sum(axis=1) / finite_counts, 0.0)
+        centred = np.where(finite, clean - shift[rows][:, None], 0.0)
+
+        sums[rows] = np.cumsum(centred, axis=1)[:, columns]
+        squares[rows] = np.cumsum(centred * centred, axis=1)[:, columns]
+        counts[rows] = np.cumsum(present, axis=1)[:, columns]
+        poisoned[rows] = np.cumsum(infinite, axis=1)[:, columns] > 0
+
+    return sums, squares, counts, poisoned, shift
+
+
+# Dates matching metrics_engine.tail_matrix(panel, values, width), NaT where padded
+def trailing_dates(dates, starts, lengths, width):
+    ends = starts + lengths
+    index = ends[:, None] - width + np.arange(width)[None, :]
+    valid = index >= starts[:, None]
+    block = np.asarray(dates).astype("datetime64[D]")[np.where(valid, index, 0)]
+    return np.where(valid, block, np.datetime64("NaT"))
+
+
+# Mean of the last k values of every ticker, NaN where the ticker has fewer than k bars or
+# the window holds an infinite value
+def trailing_mean(panel, values, windows):
+    sums, _, counts, poisoned, shift = trailing_sums(panel, values, windows)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = sums / counts + shift[:, None]
+    mean[poisoned] = np.nan
+    return np.where(enough_bars(panel, windows), mean, np.nan)
+
+
+# Sample standard deviation (ddof=1) of the last k values of every ticker, skipping NaN
+# values like pandas. NaN where the ticker has fewer than k bars.
+def trailing_std(panel, values, windows):
+    sums, squares, counts, poisoned, _ = trailing_sums(panel, values, windows)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = (squares - sums * sums / counts) / (counts - 1)
+    std = np.sqrt(np.maximum(variance, 0.0))
+    std[poisoned | (counts < 2)] = np.nan
+    return np.where(enough_bars(panel, windows), std, np.nan)
+
+
+# Percentage change between the k-th last and the last value of every ticker
+def trailing_return(panel, values, windows):
+    values = np.asarray(values, dtype=np.float64)
+    windows = np.asarray(windows, dtype=np.int64)
+    ends = panel.starts + panel.lengths
+    first = np.maximum(ends[:, None] - windows[None, :], panel.starts[:, None])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = (values[ends - 1][:, None] / values[first] - 1) * 100
+    return np.where(enough_bars(panel, windows), change, np.nan)
+
+
+def enough_bars(panel, windows):
+    return panel.lengths[:, None] >= np.asarray(windows)[None, :]
+
+
+# Daily percentage change per ticker; the first bar of each ticker has no return
+def daily_returns(panel, close):
+    close = np.asarray(close, dtype=np.float64)
+    returns = np.full(len(close), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns[1:] = close[1:] / close[:-1] - 1
+    returns[panel.starts] = np.nan
+    return returns
+
+
+# Average close, volatility of daily returns, average volume and return for each
+# (prefix, days) horizon, with the same column names and semantics as the summary table.
+# For example horizon_metrics(panel, [("3_month", 63), ("3_year", 756)]).
+def horizon_metrics(panel, horizons):
+    windows = [days for _, days in horizons]
+    close = panel.columns["CLOSE"]
+
+    stats = {
+        "avg_close": trailing_mean(panel, close, windows),
+        "volatility": trailing_std(panel, daily_returns(panel, close), windows),
+        "avg_volume": trailing_mean(panel, panel.columns["VOL"], windows),
+        "return": trailing_return(panel, close, windows),
+    }
+
+    metrics = {"TICKER": panel.tickers}
+    for column, (prefix, _) in enumerate(horizons):
+        for metric in ("avg_close", "volatility", "avg_volume", "return"):
+            metrics[f"{prefix}_{metric}"] = stats[metric][:, column]
+    return pd.DataFrame(metrics)
@@ -0,0 +1,139 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from bar_cache import load_cached_panel
+from indicators import compute_indicators
+from metrics_engine import Panel, calculate_panel_metrics
+
+# Rows (ticker x as-of date) computed together, bounding the size of the tail matrices
+BLOCK_ROWS = 8192
+
+# Tickers whose last bar is older than this on an as-of date are left out of its snapshot
+MAX_STALENESS_DAYS = 10
+
+
+# Last calendar day of every month between two dates (inclusive)
+def month_ends(start, end):
+    months = np.arange(np.datetime64(start, "M"), np.datetime64(end, "M") + 1)
+    ends = (months + 1).astype("datetime64[D]") - 1
+    return ends[(ends >= np.datetime64(start, "D")) & (ends <= np.datetime64(end, "D"))]
+
+
+# Number of bars each ticker had on each as-of date, as a (dates x tickers) matrix.
+# Relies on the tickers being stored in panel order, as build_panel and the bar cache do.
+def bars_as_of(panel, as_of_dates):
+    days = np.asarray(panel.columns["DATE"]).astype("datetime64[D]").astype(np.int64)
+    owner = np.repeat(np.arange(len(panel), dtype=np.int64), panel.lengths)
+
+    # Sorting key combining ticker and date, so one searchsorted serves every ticker
+    key = (owner << 32) + days
+    queries = (np.arange(len(panel), dtype=np.int64)[None, :] << 32) + (
+        np.asarray(as_of_dates).astype("datetime64[D]").astype(np.int64)[:, None]
+    )
+    return np.searchsorted(key, queries, side="right") - panel.starts[None, :]
+
+
+# A panel with one row per (as-of date, ticker) pair, each row covering the ticker's bars up to
+# that date. It shares the column arrays of `panel`, so computing any metric over it yields the
+# values a run on that date would have produced.
+def as_of_panel(panel, as_of_dates, min_bars=5, max_staleness_days=MAX_STALENESS_DAYS):
+    as_of_dates = np.asarray(as_of_dates).astype("datetime64[D]")
+    lengths = bars_as_of(panel, as_of_dates)
+    dates = np.asarray(panel.columns["DATE"]).astype("datetime64[D]")
+
+    last_index = panel.starts[None, :] + np.maximum(lengths, 1) - 1
+    staleness = as_of_dates[:, None] - dates[last_index]
+    keep = (lengths >= min_bars) & (staleness <= np.timedelta64(max_staleness_days, "D"))
+
+    date_index, ticker_index = np.nonzero(keep)
+    snapshot = Panel(
+        tickers=panel.tickers[ticker_index],
+        starts=panel.starts[ticker_index],
+        lengths=lengths[date_index, ticker_index],
+        columns=panel.columns,
+    )
+    return snapshot, as_of_dates[date_index], dates[last_index[date_index, ticker_index]]
+
+
+# Summary metrics (and optional indicator columns) of every ticker as of each date, with the
+# as-of date and the date of the last bar used
+def snapshot_metrics(panel, as_of_dates, indicators=(), benchmark=None, **kwargs):
+    snapshot, as_of, last_dates = as_of_panel(panel, as_of_dates, **kwargs)
+    summary = calculate_panel_metrics(snapshot)
+    if indicators:
+        extras = compute_indicators(snapshot, indicators, benchmark)
+        summary = pd.concat([summary, extras], axis=1)
+    summary.insert(1, "AS_OF", as_of)
+    summary.insert(2, "LAST_DATE", last_dates)
+    return summary
+
+
+def partition_path(output_dir, as_of_date):
+    return os.path.join(output_dir, f"as_of={np.datetime64(as_of_date, 'D')}", "summary.csv")
+
+
+# Write one partition per as-of date. Dates are processed in groups sized so that each group
+# covers about BLOCK_ROWS (ticker, date) rows.
+def write_snapshots(panel, as_of_dates, output_dir, indicators=(), benchmark=None, **kwargs):
+    as_of_dates = np.sort(np.asarray(as_of_dates).astype("datetime64[D]"))
+    dates_per_block = max(1, BLOCK_ROWS // max(len(panel), 1))
+    for first in range(0, len(as_of_dates), dates_per_block):
+        block_dates = as_of_dates[first:first + dates_per_block]
+        summary = snapshot_metrics(panel, block_dates, indicators, benchmark, **kwargs)
+        for as_of_date in block_dates:
+            path = partition_path(output_dir, as_of_date)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            summary[summary["AS_OF"] == as_of_date].to_csv(path, index=False)
+    print(f"Wrote {len(as_of_dates)} snapshots to {output_dir}")
+
+
+def load_snapshot(output_dir, as_of_date):
+    return pd.read_csv(partition_path(output_dir, as_of_date), parse_dates=["AS_OF", "LAST_DATE"])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default="bar_cache",
+        help="Bar cache written by us_stock_processing.py --cache_dir.",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="snapshots",
+        help="Root of the snapshot store, with one as_of=YYYY-MM-DD partition per date.",
+    )
+    parser.add_argument(
+        "--as_of",
+        type=str,
+        default=None,
+        help="Comma-separated as-of dates (YYYY-MM-DD).",
+    )
+    parser.add_argument(
+        "--month_ends",
+        type=str,
+        default=None,
+        help="Snapshot every month end in START:END (YYYY-MM-DD:YYYY-MM-DD).",
+    )
+    args = parser.parse_args()
+
+    as_of_dates = []
+    if args.as_of:
+        as_of_dates += [np.datetime64(date, "D") for date in args.as_of.split(",")]
+    if args.month_ends:
+        start, end = args.month_ends.split(":")
+        as_of_dates += list(month_ends(start, end))
+    if not as_of_dates:
+        parser.error("give --as_of and/or --month_ends")
+
+    panel = load_cached_panel(args.cache_dir)
+    write_snapshots(panel, np.unique(as_of_dates), args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import os
+import time
+import zipfile
+from fnmatch import fnmatch
+
+# Separates the archive path from the member name in the path of a file inside a zip archive,
+# e.g. "d_us_txt.zip::data/daily/us/nasdaq etfs/qqq.us.txt"
+MEMBER_SEPARATOR = "::"
+
+# Open archives of the current process, reopened after a fork so that worker processes never
+# share a file offset with their parent
+_archives = {}
+
+
+def is_archive(path):
+    return path.lower().endswith(".zip") and os.path.isfile(path)
+
+
+def member_path(archive_path, name):
+    return f"{archive_path}{MEMBER_SEPARATOR}{name}"
+
+
+# (archive path, member name) of a member path, (path, None) for a plain file
+def split_member_path(path):
+    archive_path, separator, name = path.partition(MEMBER_SEPARATOR)
+    return (archive_path, name) if separator else (path, None)
+
+
+def open_archive(archive_path):
+    key = (os.getpid(), archive_path)
+    if key not in _archives:
+        _archives[key] = zipfile.ZipFile(archive_path)
+    return _archives[key]
+
+
+# Whether a member lies in one of the folders. A folder matches any run of directories in the
+# member's path and may contain wildcards: "nasdaq etfs", "us/nyse stocks" or "*etfs".
+def in_folders(name, folders):
+    directory = "/" + os.path.dirname(name) + "/"
+    return any(fnmatch(directory, f"*/{folder.strip('/')}/*") for folder in folders)
+
+
+# Paths of the stooq .txt members of a zip archive, optionally restricted to some folders
+# (exchanges or asset classes), in a stable order
+def list_archive_members(archive_path, folders=None):
+    with zipfile.ZipFile(archive_path) as archive:
+        names = [
+            info.filename
+            for info in archive.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(".txt")
+        ]
+    if folders:
+        names = [name for name in names if in_folders(name, folders)]
+    return [member_path(archive_path, name) for name in sorted(names)]
+
+
+# Paths of the stooq .txt files anywhere below a directory, in a stable order
+def list_tree_files(root):
+    paths = []
+    for directory, _, names in os.walk(root):
+        paths += [os.path.join(directory, name) for name in names if name.lower().endswith(".txt")]
+    return sorted(paths)
+
+
+# Binary file object of a plain file or an archive member
+def open_source(path):
+    archive_path, name = split_member_path(path)
+    if name is None:
+        return open(path, "rb")
+    return open_archive(archive_path).open(name)
+
+
+# Size and modification time (ns) of a plain file or an archive member
+def source_stat(path):
+    archive_path, name = split_member_path(path)
+    if name is None:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    info = open_archive(archive_path).getinfo(name)
+    return info.file_size, int(time.mktime(info.date_time + (0, 0, -1))) * 10**9
@@ -1,6 +1,35 @@
+import numpy as np
 import pandas as pd
+import argparse
 import glob
+import io
+import math
 import os
+import resource
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+
+from asset_classes import ASSET_CLASSES, discover_asset_classes
+from bar_cache import cached_panel
+from db_loader import load_metrics
+from indicators import INDICATORS, benchmark_returns, compute_indicators
+from manifest import compare_with_manifest, load_manifest, save_manifest
+from metrics_engine import (
+    SUMMARY_COLUMNS,
+    advance_state,
+    build_panel,
+    concat_states,
+    day_numbers,
+    load_state,
+    panel_state,
+    save_state,
+    select_state,
+    summarize_state,
+)
+from quality import screen_panel
+from sources import is_archive, list_archive_members, open_source, source_stat
 
 # Define directory containing stock data files
 data_dir = os.path.join(os.getcwd(), "d_us_txt/data/daily/us/nasdaq etfs")
@@ -78,37 +107,649 @@ def calculate_summary_metrics(df):
     return summary
 
 
-# List to hold summary data for each stock
-summary_data = []
+# Column layout of the stooq text files
+STOOQ_COLUMNS = ['TICKER', 'PER', 'DATE', 'TIME', 'OPEN', 'HIGH', 'LOW', 'CLOSE', 'VOL', 'OPENINT']
+
+# Columns used by the metrics; the compact reader drops PER, TIME and OPENINT at read time
+BAR_COLUMNS = ['TICKER', 'DATE', 'OPEN', 'HIGH', 'LOW', 'CLOSE', 'VOL']
+
 
-# Loop through each file in the directory
-for file_path in glob.glob(os.path.join(data_dir, '*.txt')):
+# Read one stooq text file into a cleaned DataFrame sorted by date
+def read_stooq_file(file_path, compact=False):
     # Read the data into a DataFrame with specified column names
-    df = pd.read_csv(file_path, names=['TICKER', 'PER', 'DATE', 'TIME', 'OPEN', 'HIGH', 'LOW', 'CLOSE', 'VOL', 'OPENINT'])
-    
+    with open_source(file_path) as f:
+        if not compact:
+            return clean_stooq_frame(pd.read_csv(f, names=STOOQ_COLUMNS))
+        df = pd.read_csv(f, names=STOOQ_COLUMNS, usecols=BAR_COLUMNS)
+    return compact_frame(clean_stooq_frame(df))
+
+
+# Memory-compact copy of a cleaned frame: categorical ticker, int32 day numbers and float32
+# prices and volumes (about 7 significant digits, ample for stooq's 4-decimal quotes)
+def compact_frame(df):
+    columns = {
+        'TICKER': pd.Categorical(df['TICKER'].to_numpy()),
+        'DATE': day_numbers(df['DATE'].to_numpy()),
+    }
+    for column in ['OPEN', 'HIGH', 'LOW', 'CLOSE', 'VOL']:
+        columns[column] = df[column].to_numpy(np.float32)
+    return pd.DataFrame(columns)
+
+
+# Bars of a stooq file that are newer than the last processed date of its ticker, looked up
+# in last_date_of. Stooq files are sorted by date, so only the end of the file is read unless
+# it holds fewer new bars than the file does. Returns the ticker, the bars and whether the
+# ticker is new, in which case its full history is returned.
+def read_new_bars(file_path, last_date_of, tail_bytes=65536):
+    size, _ = source_stat(file_path)
+    with open_source(file_path) as f:
+        f.seek(max(0, size - tail_bytes))
+        lines = f.read().split(b'\n')
+
+    # The first line of a partial read is usually cut in the middle
+    if size > tail_bytes:
+        lines = lines[1:]
+    df = clean_stooq_frame(pd.read_csv(io.BytesIO(b'\n'.join(lines)), names=STOOQ_COLUMNS))
+    ticker = df['TICKER'].iloc[0] if len(df) > 0 else None
+    if ticker not in last_date_of:
+        df = read_stooq_file(file_path)
+        return (df['TICKER'].iloc[0] if len(df) > 0 else None), df, True
+
+    last_date = pd.Timestamp(last_date_of[ticker])
+    if size > tail_bytes and df['DATE'].iloc[0] > last_date:
+        df = read_stooq_file(file_path)
+    return ticker, df[df['DATE'] > last_date], False
+
+
+# Clean raw stooq rows: parse dates and numbers, drop unusable rows and sort by date
+def clean_stooq_frame(df):
     # Convert DATE to datetime format with error handling
     df['DATE'] = pd.to_datetime(df['DATE'], format='%Y%m%d', errors='coerce')
     
     # Drop rows where DATE conversion failed
     df = df.dropna(subset=['DATE'])
     
-    # Convert CLOSE and VOL columns to numeric, setting errors='coerce' to handle non-numeric values
-    df['CLOSE'] = pd.to_numeric(df['CLOSE'], errors='coerce')
-    df['VOL'] = pd.to_numeric(df['VOL'], errors='coerce')
+    # Convert price and volume columns to numeric, setting errors='coerce' to handle non-numeric values
+    for column in ['OPEN', 'HIGH', 'LOW', 'CLOSE', 'VOL']:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
     
     # Drop rows with NaN values in CLOSE or VOL columns after conversion
     df = df.dropna(subset=['CLOSE', 'VOL'])
     
     # Sort data by date
-    df = df.sort_values(by='DATE')
+    return df.sort_values(by='DATE', kind='stable')
+
+
+# List the stooq files in data_dir in a stable order. data_dir may also be a stooq zip archive,
+# whose members are read in place, optionally only those in some folders (e.g. "nasdaq etfs").
+def list_stooq_files(data_dir, folders=None):
+    if is_archive(data_dir):
+        return list_archive_members(data_dir, folders)
+    return sorted(glob.glob(os.path.join(data_dir, '*.txt')))
+
+
+# Load every ticker in data_dir
+def load_frames(data_dir):
+    return read_frames(list_stooq_files(data_dir))
+
+
+# Cleaned frame of a file, or None when it has fewer than 5 rows for the 5-day metrics
+def read_usable_frame(file_path, compact=False):
+    df = read_stooq_file(file_path, compact)
+    return df if len(df) >= 5 else None
+
+
+# Parse the given files, keeping the tickers with enough rows
+def read_frames(file_paths, compact=False):
+    frames = []
+    for file_path in file_paths:
+        df = read_usable_frame(file_path, compact)
+        if df is not None:
+            frames.append(df)
+    return frames
+
+
+# Rolling state, indicator columns and quality report of a panel. quality is None (no
+# screening), "flag" (report only) or "repair" (also drop bad prices and spikes, see quality.py).
+def process_panel(panel, indicators=(), benchmark=None, quality=None):
+    report = None
+    if quality is not None:
+        panel, report = screen_panel(panel, repair=quality == "repair")
+    return panel_state(panel), compute_indicators(panel, indicators, benchmark), report
+
+
+# Parse a batch of files and compute their rolling state, the columns of the requested
+# indicators and their quality report (also the unit of work of a worker process). With
+# compact=True the bars are held in compact dtypes (see build_panel).
+def process_files(file_paths, indicators=(), benchmark=None, compact=False, quality=None):
+    panel = build_panel(read_frames(file_paths, compact), compact=compact)
+    return process_panel(panel, indicators, benchmark, quality)
+
+
+# The shared executor when one is given, else a new pool of `workers` processes
+def worker_pool(workers, executor=None):
+    return nullcontext(executor) if executor is not None else ProcessPoolExecutor(max_workers=workers)
+
+
+# Rolling state, indicator columns and quality report of all files, optionally fanned out over a
+# process pool (its own, or the executor shared by several runs). Batches are merged in
+# submission order, so the output order does not depend on the worker count. With a cache_dir the
+# bars come from the columnar cache and only changed files are parsed, over the process pool when
+# there are workers.
+def build_state(
+    file_paths,
+    workers=1,
+    chunk_size=None,
+    cache_dir=None,
+    indicators=(),
+    benchmark=None,
+    compact=False,
+    quality=None,
+    executor=None,
+):
+    if cache_dir is not None:
+        if workers <= 1:
+            panel, parsed = cached_panel(cache_dir, file_paths, read_usable_frame)
+        else:
+            with worker_pool(workers, executor) as executor:
+                map_frames = partial(executor.map, chunksize=chunk_size or 16)
+                panel, parsed = cached_panel(cache_dir, file_paths, read_usable_frame, map_frames)
+        print(f"Bar cache: parsed {parsed} of {len(file_paths)} files")
+        return process_panel(panel, indicators, benchmark, quality)
+
+    if workers <= 1 or len(file_paths) <= 1:
+        return process_files(file_paths, indicators, benchmark, compact, quality)
+
+    if chunk_size is None:
+        # A few batches per worker keeps the pool busy when file sizes are uneven
+        chunk_size = max(1, math.ceil(len(file_paths) / (workers * 4)))
+    chunks = [file_paths[i:i + chunk_size] for i in range(0, len(file_paths), chunk_size)]
+
+    work = partial(process_files, indicators=indicators, benchmark=benchmark, compact=compact, quality=quality)
+    with worker_pool(workers, executor) as executor:
+        states, extras, reports = zip(*executor.map(work, chunks))
+    report = pd.concat(reports, ignore_index=True) if quality is not None else None
+    return concat_states(states), pd.concat(extras, ignore_index=True), report
+
+
+# Summary table of a state followed by the indicator columns of the same tickers
+def summarize_with_indicators(state, extras):
+    return pd.concat([summarize_state(state), extras.reset_index(drop=True)], axis=1)
+
+
+# Summary metrics for all files, computed in vectorized passes over panels of tickers
+def summarize_files(
+    file_paths, workers=1, chunk_size=None, cache_dir=None, indicators=(), benchmark=None, compact=False, quality=None
+):
+    state, extras, _ = build_state(
+        file_paths,
+        workers=workers,
+        chunk_size=chunk_size,
+        cache_dir=cache_dir,
+        indicators=indicators,
+        benchmark=benchmark,
+        compact=compact,
+        quality=quality,
+    )
+    return summarize_with_indicators(state, extras)
+
+
+# Dates and returns of the benchmark used by the beta indicator, read from its stooq file
+def load_benchmark(file_path):
+    df = read_stooq_file(file_path)
+    return benchmark_returns(df['DATE'].to_numpy(), df['CLOSE'].to_numpy())
+
+
+# Group files into consecutive batches holding at most max_bytes of source text.
+# A file larger than max_bytes forms a batch of its own.
+def iter_file_batches(file_paths, max_bytes):
+    batch = []
+    batch_bytes = 0
+    for file_path in file_paths:
+        size, _ = source_stat(file_path)
+        if batch and batch_bytes + size > max_bytes:
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(file_path)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+# Summary rows of one batch of files (the unit of work of the streaming mode)
+def summarize_batch(file_paths, indicators=(), benchmark=None, compact=False, quality=None):
+    state, extras, _ = process_files(file_paths, indicators, benchmark, compact, quality)
+    return summarize_with_indicators(state, extras)
+
+
+# Write the summary of all files to output_file batch by batch. Only the bars of the batches
+# being processed (one per worker) are held in memory, whatever the size of the universe.
+def stream_summary(
+    file_paths,
+    output_file,
+    max_bytes,
+    workers=1,
+    indicators=(),
+    benchmark=None,
+    compact=False,
+    quality=None,
+    executor=None,
+):
+    batches = iter_file_batches(file_paths, max_bytes)
+    work = partial(summarize_batch, indicators=indicators, benchmark=benchmark, compact=compact, quality=quality)
+    rows = 0
+    with open(output_file, 'w', newline='') as output:
+        if workers <= 1:
+            rows = write_summaries(map(work, batches), output)
+        else:
+            with worker_pool(workers, executor) as executor:
+                rows = write_summaries(executor.map(work, batches), output)
+    return rows
+
+
+# Append summary batches to an open CSV file, writing the header once
+def write_summaries(summaries, output):
+    rows = 0
+    header = True
+    for summary in summaries:
+        if len(summary) == 0:
+            continue
+        summary.to_csv(output, index=False, header=header)
+        header = False
+        rows += len(summary)
+    if header:
+        pd.DataFrame(columns=SUMMARY_COLUMNS).to_csv(output, index=False)
+    return rows
+
+
+# Bring a saved rolling state up to date with the files, reading only the bars that arrived
+# since each ticker's last processed date. Tickers seen for the first time are processed in
+# full. The result follows the file order; tickers without a file are kept at the end.
+# With a manifest (see manifest.py), unchanged files are not read at all, files whose earlier
+# bars were rewritten are reprocessed from scratch and the tickers of deleted files are dropped.
+# Returns the state and the updated manifest (None without one).
+def update_state(state, file_paths, manifest=None):
+    changes = {}
+    dropped = set()
+    if manifest is not None:
+        changes, removed = compare_with_manifest(manifest, file_paths)
+        dropped = {entry["ticker"] for entry in removed.values()}
+        dropped |= {manifest[path]["ticker"] for path, (status, _) in changes.items() if status == "rewritten"}
+        kept = [row for row, ticker in enumerate(state.tickers) if ticker not in dropped]
+        state = select_state(state, np.array(kept, dtype=np.int64))
+    last_date_of = dict(zip(state.tickers, state.last_dates))
+
+    update_frames = []
+    new_frames = []
+    file_tickers = []
+    ticker_of_path = {}
+    for file_path in file_paths:
+        status, record = changes.get(file_path, (None, None))
+        if status == "unchanged":
+            ticker_of_path[file_path] = record["ticker"]
+            file_tickers.append(record["ticker"])
+            continue
+
+        ticker, df, is_new = read_new_bars(file_path, last_date_of)
+        ticker_of_path[file_path] = ticker
+        if is_new:
+            # Same threshold as a full run: at least 5 rows for the 5-day metrics
+            if len(df) < 5:
+                continue
+            new_frames.append(df)
+        elif len(df) > 0:
+            update_frames.append(df)
+        file_tickers.append(ticker)
+
+    state = advance_state(state, build_panel(update_frames))
+    state = concat_states([state, panel_state(build_panel(new_frames))])
+
+    row_of = {ticker: row for row, ticker in enumerate(state.tickers)}
+    rows = [row_of.pop(ticker) for ticker in file_tickers if ticker in row_of]
+    rows += sorted(row_of.values())
+    state = select_state(state, np.array(rows, dtype=np.int64))
+
+    if manifest is None:
+        return state, None
+    if dropped:
+        print(f"Dropped {len(dropped)} tickers whose files were deleted or rewritten")
+    return state, manifest_entries(changes, ticker_of_path, state)
+
+
+# Ticker of a stooq file, read from its first row
+def read_ticker(file_path):
+    with open_source(file_path) as f:
+        f.readline()
+        return f.readline().decode().split(',')[0].strip() or None
+
+
+# Manifest entries of the processed files: the records from compare_with_manifest completed
+# with each file's ticker and the date of its last bar in the state
+def manifest_entries(changes, ticker_of_path, state):
+    last_date_of = dict(zip(state.tickers, state.last_dates))
+    manifest = {}
+    for file_path, (_, record) in changes.items():
+        ticker = ticker_of_path[file_path]
+        last_date = last_date_of.get(ticker)
+        manifest[file_path] = dict(
+            record,
+            ticker=ticker,
+            last_date=None if last_date is None else str(np.datetime64(last_date, 'D')),
+        )
+    return manifest
+
+
+# Write the quality report rows of the tickers with at least one flagged bar
+def write_quality_report(report, output_file):
+    flagged = report[report.drop(columns=['TICKER', 'bars']).to_numpy().sum(axis=1) > 0]
+    flagged.to_csv(output_file, index=False)
+    print(f"Quality: {len(flagged)} of {len(report)} tickers flagged, {report['removed'].sum()} bars removed")
+
+
+# Peak resident memory in MB of this process and of the largest finished worker process
+def peak_memory_mb():
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    unit = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2**20
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2**20
+
+    # On Linux ru_maxrss survives exec, so a process started by a large parent would report the
+    # parent's peak; VmHWM covers this process only
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    own = int(line.split()[1]) / 1024
+    return own, workers
+
+
+def report_peak_memory():
+    own, workers = peak_memory_mb()
+    print(f"Peak memory: {own:.0f} MB (largest worker: {workers:.0f} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data_dir",
+        type=str,
+        default=data_dir,
+        help="Directory containing the stooq .txt files to process, or a stooq .zip archive "
+        "whose members are read without extracting it. With --asset_classes, the roots of the "
+        f"stooq bundles (directories or zip archives) separated by '{os.pathsep}'.",
+    )
+    parser.add_argument(
+        "--asset_classes",
+        type=str,
+        default="",
+        help=f"Comma-separated asset classes, or 'all', to discover under --data_dir and process in "
+        f"one run ({', '.join(ASSET_CLASSES)}). Each class gets its own summary, state, manifest, "
+        "cache and quality report (named after the class) and its own table with --database. "
+        "With --workers, the classes are processed concurrently over one shared worker pool.",
+    )
+    parser.add_argument(
+        "--folders",
+        type=str,
+        default="",
+        help="Comma-separated archive folders to read when --data_dir is a zip archive, e.g. "
+        "'nasdaq etfs,nyse etfs' (wildcards allowed). All .txt members are read by default.",
+    )
+    parser.add_argument(
+        "--output_file",
+        type=str,
+        default=None,
+        help="Where to write the summary metrics (summary_etf_data.csv, or "
+        "summary_{asset_class}_data.csv with --asset_classes).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used to parse files and compute metrics (1 runs serially).",
+    )
+    parser.add_argument(
+        "--state_file",
+        type=str,
+        default="metrics_state.npz",
+        help="Where the per-ticker rolling state is persisted between runs.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Directory of the columnar bar cache. Files whose size and mtime are unchanged "
+        "are loaded from the cache instead of being parsed again.",
+    )
+    parser.add_argument(
+        "--database",
+        type=str,
+        default=None,
+        help="PostgreSQL database to load the summary metrics into. Only the CSV is written when omitted.",
+    )
+    parser.add_argument(
+        "--table",
+        type=str,
+        default="etfs",
+        help="Table that is replaced with the summary metrics (with --asset_classes, each class "
+        "is loaded into the table of the same name).",
+    )
+    parser.add_argument(
+        "--db_user",
+        type=str,
+        default="creator_role",
+        help="PostgreSQL role allowed to create tables in the database.",
+    )
+    parser.add_argument(
+        "--db_password",
+        type=str,
+        default="creator_role",
+        help="Password of --db_user.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Process the files in batches and append their summary rows to the output as they "
+        "are computed, keeping memory bounded for very large universes. No rolling state is saved.",
+    )
+    parser.add_argument(
+        "--batch_mb",
+        type=int,
+        default=256,
+        help="Maximum size in MB of the source files processed together in --stream mode.",
+    )
+    parser.add_argument(
+        "--indicators",
+        type=str,
+        default="",
+        help=f"Comma-separated indicators appended as extra columns, or 'all'. Available: {', '.join(INDICATORS)}.",
+    )
+    parser.add_argument(
+        "--benchmark_file",
+        type=str,
+        default=None,
+        help="Stooq file of the benchmark index used by the beta indicator.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Update the saved rolling state with the bars added since the last run instead of "
+        "recomputing all history. Falls back to a full run when no state has been saved yet.",
+    )
+    parser.add_argument(
+        "--manifest_file",
+        type=str,
+        default=None,
+        help="Manifest of the processed files (size, mtime, content hash, last bar date). With "
+        "--incremental, unchanged files are skipped, rewritten files are reprocessed and the "
+        "tickers of deleted files are removed from the summary.",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Read only the columns the metrics use and hold the bars as categorical tickers, "
+        "int32 dates and float32 prices and volumes, about half the memory of the default dtypes. "
+        "Metrics differ from the default mode only by float32 rounding of the bars.",
+    )
+    parser.add_argument(
+        "--quality",
+        choices=["flag", "repair"],
+        default=None,
+        help="Screen the bars for bad prices, return jumps and bad ticks, stale prices, zero-volume "
+        "streaks, volume spikes and calendar gaps. 'flag' only reports them; 'repair' also drops "
+        "bars with bad prices and reverted spikes before computing the metrics.",
+    )
+    parser.add_argument(
+        "--quality_report",
+        type=str,
+        default="quality_report.csv",
+        help="Where to write the per-ticker counts of flagged bars of tickers with any flag (not written in --stream mode).",
+    )
+    parser.add_argument(
+        "--report_memory",
+        action="store_true",
+        help="Print the peak memory of the run, e.g. to compare it with and without --compact.",
+    )
+    args = parser.parse_args()
+
+    if args.stream and (args.incremental or args.cache_dir is not None or args.manifest_file is not None):
+        parser.error("--stream cannot be combined with --incremental, --cache_dir or --manifest_file")
+    if args.compact and args.cache_dir is not None:
+        # The cache keeps full-precision bars that later runs reuse
+        parser.error("--compact cannot be combined with --cache_dir")
+
+    indicators = list(INDICATORS) if args.indicators == "all" else [
+        name for name in args.indicators.split(",") if name
+    ]
+    if args.quality is not None and args.incremental:
+        parser.error("--quality screens the full history and cannot be combined with --incremental")
+    if indicators and args.incremental:
+        parser.error("--indicators need the full history and cannot be combined with --incremental")
+    if "beta" in indicators and args.benchmark_file is None:
+        if args.indicators != "all":
+            parser.error("the beta indicator needs --benchmark_file")
+        indicators.remove("beta")
+    benchmark = load_benchmark(args.benchmark_file) if args.benchmark_file else None
+
+    folders = [folder for folder in args.folders.split(",") if folder]
+    if folders and (args.asset_classes or not is_archive(args.data_dir)):
+        parser.error("--folders only applies when --data_dir is a single zip archive")
+
+    if not args.asset_classes:
+        args.output_file = args.output_file or "summary_etf_data.csv"
+        run_summary(list_stooq_files(args.data_dir, folders), args, indicators, benchmark)
+    else:
+        classes = list(ASSET_CLASSES) if args.asset_classes == "all" else args.asset_classes.split(",")
+        unknown = [asset_class for asset_class in classes if asset_class not in ASSET_CLASSES]
+        if unknown:
+            parser.error(f"unknown asset classes {unknown}, available: {', '.join(ASSET_CLASSES)}")
+        args.output_file = args.output_file or "summary_{asset_class}_data.csv"
+
+        discovered = discover_asset_classes(args.data_dir.split(os.pathsep), classes)
+        runs = []
+        for asset_class in classes:
+            if asset_class not in discovered:
+                print(f"{asset_class}: no files found")
+                continue
+            print(f"{asset_class}: {len(discovered[asset_class])} files")
+            runs.append((discovered[asset_class], asset_class_args(args, asset_class)))
+
+        if args.workers <= 1 or len(runs) <= 1:
+            for file_paths, class_args in runs:
+                run_summary(file_paths, class_args, indicators, benchmark)
+        else:
+            # One thread per class submits its batches to the shared pool and merges and writes
+            # its own results, so the workers stay busy across classes of very different sizes
+            with ProcessPoolExecutor(max_workers=args.workers) as executor, ThreadPoolExecutor(len(runs)) as threads:
+                futures = [
+                    threads.submit(run_summary, file_paths, class_args, indicators, benchmark, executor)
+                    for file_paths, class_args in runs
+                ]
+                for future in futures:
+                    future.result()
+
+    if args.report_memory:
+        report_peak_memory()
+
+
+# Compute the summary of the files as configured by the command line arguments: stream it, or
+# update or rebuild the rolling state, and write the summary to the CSV file and the database.
+# executor is a process pool shared with other runs, else each stage starts its own.
+def run_summary(file_paths, args, indicators, benchmark, executor=None):
+    if args.stream:
+        rows = stream_summary(
+            file_paths,
+            args.output_file,
+            args.batch_mb * 1024 * 1024,
+            workers=args.workers,
+            indicators=indicators,
+            benchmark=benchmark,
+            compact=args.compact,
+            quality=args.quality,
+            executor=executor,
+        )
+        print(f"Wrote {rows} summary rows to {args.output_file}")
+        if args.database is not None:
+            # The summary itself is small; only the bars needed batching
+            summary_df = pd.read_csv(args.output_file)
+            load_metrics(summary_df, args.table, args.database, args.db_user, args.db_password)
+        return
+
+    manifest = None
+    if args.incremental and os.path.exists(args.state_file):
+        previous = load_manifest(args.manifest_file) if args.manifest_file else None
+        state, manifest = update_state(load_state(args.state_file), file_paths, previous)
+        final_summary_df = summarize_state(state)
+    else:
+        # Stack the tickers into panels and compute the state in vectorized passes
+        state, extras, report = build_state(
+            file_paths,
+            workers=args.workers,
+            cache_dir=args.cache_dir,
+            indicators=indicators,
+            benchmark=benchmark,
+            compact=args.compact,
+            quality=args.quality,
+            executor=executor,
+        )
+        final_summary_df = summarize_with_indicators(state, extras)
+        if report is not None:
+            write_quality_report(report, args.quality_report)
+        if args.manifest_file:
+            changes, _ = compare_with_manifest({}, file_paths)
+            manifest = manifest_entries(changes, {path: read_ticker(path) for path in file_paths}, state)
+    save_state(state, args.state_file)
+    if manifest is not None:
+        save_manifest(manifest, args.manifest_file)
+
+    # Save the final summary data to a CSV file
+    final_summary_df.to_csv(args.output_file, index=False)
+
+    if args.database is not None:
+        load_metrics(final_summary_df, args.table, args.database, args.db_user, args.db_password)
+
+
+# Path of a per-class file: "{asset_class}" in the path is replaced with the class, otherwise the
+# class is appended to the file name (metrics_state.npz -> metrics_state_etfs.npz)
+def asset_class_path(path, asset_class):
+    if "{asset_class}" in path:
+        return path.replace("{asset_class}", asset_class)
+    root, extension = os.path.splitext(path)
+    return f"{root}_{asset_class}{extension}"
 
-    # Calculate summary metrics for each stock if there are enough data points
-    if len(df) >= 5:  # Ensure there's at least 5 rows for the 5-day metrics
-        stock_summary = calculate_summary_metrics(df)
-        summary_data.append(stock_summary)
 
-# Convert the list of dictionaries to a DataFrame
-final_summary_df = pd.DataFrame(summary_data)
+# Arguments of the run of one asset class: its own output, state, manifest, cache, quality
+# report and table
+def asset_class_args(args, asset_class):
+    return argparse.Namespace(**dict(
+        vars(args),
+        output_file=asset_class_path(args.output_file, asset_class),
+        state_file=asset_class_path(args.state_file, asset_class),
+        manifest_file=args.manifest_file and asset_class_path(args.manifest_file, asset_class),
+        cache_dir=args.cache_dir and os.path.join(args.cache_dir, asset_class),
+        quality_report=asset_class_path(args.quality_report, asset_class),
+        table=asset_class,
+    ))
 
-# Save the final summary data to a CSV file
-final_summary_df.to_csv('summary_etf_data.csv', index=False)
+if __name__ == "__main__":
+    main()
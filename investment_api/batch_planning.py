@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import json
+import os
+
+import pandas as pd
+
+from investment_api import investment_plan_api as api
+from investment_api.optimizer import OBJECTIVES
+from investment_api.plan_cache import profile_preferences, profile_text, profile_value, profile_weeks, with_name, without_name
+
+# Profile fields of plan_investment, in its argument order
+PROFILE_FIELDS = [
+    "customer_name",
+    "age",
+    "income",
+    "occupation",
+    "budget_usd",
+    "time_horizon_weeks",
+    "risk_level",
+    "asset_preference",
+    "liquidity",
+]
+
+
+# Customer profiles of a CSV or JSON Lines file, as dicts holding a customer_id (the file's
+# customer_id column, else the row number) and the profile fields (None when missing)
+def read_profiles(path):
+    if path.endswith(".jsonl"):
+        with open(path, "r") as profiles_file:
+            records = [json.loads(line) for line in profiles_file if line.strip()]
+    else:
+        records = pd.read_csv(path, dtype=str, keep_default_na=False).to_dict("records")
+
+    profiles = []
+    for row, record in enumerate(records):
+        profile = {field: record.get(field) or None for field in PROFILE_FIELDS}
+        profile["customer_id"] = str(record.get("customer_id", row))
+        profiles.append(profile)
+    return profiles
+
+
+# Records of the customers that already have a plan in the output file, by customer id, so that
+# a rerun after a failure resumes where it stopped
+def completed_records(output_file):
+    completed = {}
+    if not os.path.exists(output_file):
+        return completed
+    with open(output_file, "r") as output:
+        for line in output:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by the interruption
+                continue
+            if record.get("plan") is not None:
+                completed[record["customer_id"]] = record
+    return completed
+
+
+# Rewrite the output file with one record per completed customer, dropping the records of the
+# failed ones (retried by this run) and any line cut short
+def rewrite_completed(output_file, completed):
+    if not os.path.exists(output_file):
+        return
+    temporary_file = output_file + ".tmp"
+    with open(temporary_file, "w") as output:
+        for record in completed.values():
+            output.write(json.dumps(record) + "\n")
+    os.replace(temporary_file, output_file)
+
+
+# Normalized profile, without the customer's name: customers with the same one get the same plan
+def exact_profile(profile):
+    return (
+        profile_value(profile["age"]),
+        profile_value(profile["income"]),
+        profile_text(profile["occupation"]),
+        profile_value(profile["budget_usd"]),
+        profile_value(profile["time_horizon_weeks"], profile_weeks),
+        profile_text(profile["risk_level"]),
+        profile_preferences(profile["asset_preference"]),
+        profile_text(profile["liquidity"]),
+    )
+
+
+# Profiles grouped by exact normalized profile: customers of a group share one plan, with their
+# own name
+def group_profiles(profiles):
+    groups = {}
+    for profile in profiles:
+        groups.setdefault(exact_profile(profile), []).append(profile)
+    return list(groups.values())
+
+
+def plan_text(plan):
+    return getattr(plan, "content", plan)
+
+
+# Plan one group: the first customer's plan is generated and the others get it with their own
+# name. The plan cache is bypassed, as it would share plans between profiles of the same bands.
+async def plan_group(profiles, semaphore, output, model_name, llm_params, objective, retries):
+    first = profiles[0]
+    plan = None
+    error = None
+    async with semaphore:
+        for attempt in range(retries + 1):
+            try:
+                plan = await api.aplan_investment(
+                    *[first[field] for field in PROFILE_FIELDS],
+                    model_name=model_name,
+                    llm_params=llm_params,
+                    use_cache=False,
+                    objective=objective,
+                )
+                error = None if plan is not None else "The draft plan could not be parsed"
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            if plan is not None:
+                break
+            if attempt < retries:
+                await asyncio.sleep(2 ** attempt)
+
+    shared_plan = without_name(plan, first["customer_name"]) if plan is not None else None
+    for profile in profiles:
+        customer_plan = with_name(shared_plan, profile["customer_name"]) if plan is not None else None
+        record = {
+            "customer_id": profile["customer_id"],
+            "customer_name": profile["customer_name"],
+            "plan": plan_text(customer_plan) if customer_plan is not None else None,
+            "error": error,
+        }
+        output.write(json.dumps(record) + "\n")
+    output.flush()
+    return plan is not None
+
+
+# Plan every profile not yet in the output file, with at most `concurrency` plans generated at
+# once, appending one JSON line per customer as soon as its group is done. The output file keeps
+# one line per customer across reruns.
+async def plan_batch(profiles, output_file, concurrency=4, model_name="gpt-4o", llm_params=None, objective=None, retries=2):
+    completed = completed_records(output_file)
+    rewrite_completed(output_file, completed)
+    pending = [profile for profile in profiles if profile["customer_id"] not in completed]
+    groups = group_profiles(pending)
+    print(f"{len(profiles)} customers, {len(completed)} already planned, {len(pending)} to plan in {len(groups)} distinct profiles")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    with open(output_file, "a") as output:
+        results = await asyncio.gather(*[
+            plan_group(members, semaphore, output, model_name, llm_params, objective, retries)
+            for members in groups
+        ])
+    failed = sum(not planned for planned in results)
+    print(f"Planned {len(groups) - failed} of {len(groups)} profiles")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profiles",
+        type=str,
+        required=True,
+        help="CSV or JSON Lines file of customer profiles, with the plan_investment fields and an optional customer_id.",
+    )
+    parser.add_argument(
+        "--output_file",
+        type=str,
+        default="plans.jsonl",
+        help="JSON Lines file the plans are appended to. Customers already planned in it are skipped, failed ones retried.",
+    )
+    parser.add_argument("--concurrency", type=int, default=4, help="Plans generated at once.")
+    parser.add_argument("--model_name", type=str, default="gpt-4o")
+    parser.add_argument(
+        "--objective",
+        type=str,
+        default=None,
+        choices=OBJECTIVES,
+        help="Optimize the screened candidates and simulate the outcomes of the portfolio.",
+    )
+    parser.add_argument("--retries", type=int, default=2, help="Retries of a failed plan, with exponential backoff.")
+    args = parser.parse_args()
+
+    profiles = read_profiles(args.profiles)
+    failed = asyncio.run(plan_batch(
+        profiles, args.output_file, args.concurrency, args.model_name, objective=args.objective, retries=args.retries
+    ))
+    if failed:
+        raise SystemExit(f"{failed} profiles failed, rerun to retry them")
+
+
+if __name__ == "__main__":
+    main()
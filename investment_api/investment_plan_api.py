@@ -1,14 +1,86 @@
 from jinja2 import Template
 from langchain_openai import ChatOpenAI
+import asyncio
 import datetime
 import os
 import json
 import re
 
+import numpy as np
+
+from investment_api import optimizer, plan_updates, screener, simulator
+from investment_api.plan_cache import PlanCache, profile_key, profile_number, profile_weeks, with_content
+
 # Config the prompts directory for the investment plan API
 api_prompt_dir = os.path.join(os.getcwd(), "investment_api/prompt")
 
-def create_portfolio_draft(
+# Directory of the summary files written by data_script/us_stock_processing.py --asset_classes all
+api_data_dir = os.path.join(os.getcwd(), "data_script")
+
+# Risk models written by data_script/covariance.py: one directory for the whole universe, or one
+# subdirectory per asset class (covariance/stocks, covariance/etfs, ...)
+api_covariance_dir = os.path.join(os.getcwd(), "data_script/covariance")
+
+# Label and summary file of the metrics screened for each investment type
+SCREENING_DATA = {
+    "Stocks": ("stocks", "summary_stocks_data.csv"),
+    "ETFs": ("ETFs", "summary_etfs_data.csv"),
+    "Stock Indices": ("stock indices", "summary_indices_data.csv"),
+    "US Bonds": ("US bonds", "summary_bonds_data.csv"),
+    "Crypto": ("crypto assets", "summary_crypto_data.csv"),
+}
+
+# Plans of recent profiles, shared by customers with the same profile key (see plan_cache.profile_key)
+plan_cache = PlanCache(max_entries=256)
+
+# Compiled templates of the prompt directory, recompiled when a prompt file changes
+_templates = {}
+
+# Chat clients keyed by model, parameters and API key. A client keeps its HTTP connection pool
+# alive, so reusing it saves the connection and TLS setup of every request.
+_llm_clients = {}
+
+
+def prompt_template(prompt_name):
+    prompt_file_path = os.path.join(api_prompt_dir, prompt_name)
+    mtime_ns = os.stat(prompt_file_path).st_mtime_ns
+    cached = _templates.get(prompt_name)
+    if cached is None or cached[0] != mtime_ns:
+        # Load the prompt from the prompt directory
+        with open(prompt_file_path, "r") as prompt_file:
+            # Use Jinja2 for better placeholder handling
+            cached = (mtime_ns, Template(prompt_file.read()))
+        _templates[prompt_name] = cached
+    return cached[1]
+
+
+# Render a prompt of the prompt directory with the given inputs
+def render_prompt(prompt_name, prompt_inputs):
+    prompt = prompt_template(prompt_name).render(**prompt_inputs)
+
+    # Check for unreplaced placeholders
+    unreplaced_placeholders = re.findall(r"\{\{(.*?)\}\}", prompt)
+    if unreplaced_placeholders:
+        print(f"Warning: The following placeholders were not replaced: {unreplaced_placeholders}")
+
+    return prompt
+
+
+def create_llm(model_name, llm_params):
+    llm_params = llm_params or {}
+    api_key = os.environ["OPENAI_API_KEY"]
+    key = (model_name, json.dumps(llm_params, sort_keys=True, default=repr), api_key)
+    if key not in _llm_clients:
+        # Instantiate the ChatOpenAI model
+        _llm_clients[key] = ChatOpenAI(
+            model=model_name,
+            api_key=api_key,
+            **llm_params
+        )
+    return _llm_clients[key]
+
+
+def draft_prompt(
     customer_name,
     age,
     income,
@@ -17,18 +89,8 @@ def create_portfolio_draft(
     time_horizon_weeks,
     risk_level,
     asset_preference,
-    liquidity,
-    model_name="gpt-4o",
-    llm_params=None
+    liquidity
 ):
-    if llm_params is None:
-        llm_params = {}
-
-    # Load the prompt from the prompt directory
-    prompt_file_path = os.path.join(api_prompt_dir, "draft_investment_plan.prompt")
-    with open(prompt_file_path, "r") as prompt_file:
-        prompt_template = prompt_file.read()
-
     # Prepare template inputs with 'not provided' only for debug visibility
     prompt_inputs = {
         "customer_name": customer_name or "not provided",
@@ -43,28 +105,10 @@ def create_portfolio_draft(
         "date": datetime.datetime.now().strftime("%Y-%m-%d"),
         "day": datetime.datetime.now().strftime("%A")
     }
+    return render_prompt("draft_investment_plan.prompt", prompt_inputs)
 
-    # Use Jinja2 for better placeholder handling
-    template = Template(prompt_template)
-    prompt = template.render(**prompt_inputs)
-
-    # Check for unreplaced placeholders
-    unreplaced_placeholders = re.findall(r"\{\{(.*?)\}\}", prompt)
-    if unreplaced_placeholders:
-        print(f"Warning: The following placeholders were not replaced: {unreplaced_placeholders}")
-
-    # Instantiate the ChatOpenAI model
-    llm = ChatOpenAI(
-        model=model_name,
-        api_key=os.environ["OPENAI_API_KEY"],
-        **llm_params
-    )
-
-    # Generate the response using the prompt
-    response = llm(prompt)
-
-    response_text = response.content
 
+def parse_draft_response(response_text):
     # Parse the response to a human-readable format
     try:
         parsed_response = json.dumps(json.loads(response_text), indent=4) if response_text.startswith('{') else response_text
@@ -78,21 +122,53 @@ def create_portfolio_draft(
     return parsed_response
 
 
+def create_portfolio_draft(
+    customer_name,
+    age,
+    income,
+    occupation,
+    budget_usd,
+    time_horizon_weeks,
+    risk_level,
+    asset_preference,
+    liquidity,
+    model_name="gpt-4o",
+    llm_params=None
+):
+    prompt = draft_prompt(
+        customer_name, age, income, occupation, budget_usd, time_horizon_weeks, risk_level, asset_preference, liquidity
+    )
 
-def create_detailed_portfolio(
-    draft_portfolio,
-    detailed_plan,
+    # Generate the response using the prompt
+    response = create_llm(model_name, llm_params)(prompt)
+
+    return parse_draft_response(response.content)
+
+
+async def acreate_portfolio_draft(
+    customer_name,
+    age,
+    income,
+    occupation,
+    budget_usd,
+    time_horizon_weeks,
+    risk_level,
+    asset_preference,
+    liquidity,
     model_name="gpt-4o",
     llm_params=None
 ):
-    if llm_params is None:
-        llm_params = {}
+    prompt = draft_prompt(
+        customer_name, age, income, occupation, budget_usd, time_horizon_weeks, risk_level, asset_preference, liquidity
+    )
+
+    # Generate the response without blocking the event loop
+    response = await create_llm(model_name, llm_params).ainvoke(prompt)
+
+    return parse_draft_response(response.content)
 
-    # Load the prompt from the prompt directory
-    prompt_file_path = os.path.join(api_prompt_dir, "detailed_investment_plan.prompt")
-    with open(prompt_file_path, "r") as prompt_file:
-        prompt_template = prompt_file.read()
 
+def detailed_prompt(draft_portfolio, detailed_plan, outcome_detail=None):
     # Prepare template inputs with 'not provided' only for debug visibility
     def get_detail(plan, category, index, default="not provided"):
         return plan.get(category, [None] * (index + 1))[index] if category in plan and len(plan[category]) > index else default
@@ -109,59 +185,256 @@ def create_detailed_portfolio(
         "bonds_criteria": get_detail(detailed_plan, "US Bonds", 0),
         "crypto_detail": get_detail(detailed_plan, "Crypto", 1),
         "crypto_criteria": get_detail(detailed_plan, "Crypto", 0),
+        "outcome_detail": outcome_detail or "",
     }
+    return render_prompt("detailed_investment_plan.prompt", prompt_inputs)
 
-    # Use Jinja2 for better placeholder handling
-    template = Template(prompt_template)
-    prompt = template.render(**prompt_inputs)
-
-    # Check for unreplaced placeholders
-    unreplaced_placeholders = re.findall(r"\{\{(.*?)\}\}", prompt)
-    if unreplaced_placeholders:
-        print(f"Warning: The following placeholders were not replaced: {unreplaced_placeholders}")
 
-    # Instantiate the ChatOpenAI model
-    llm = ChatOpenAI(
-        model=model_name,
-        api_key=os.environ["OPENAI_API_KEY"],
-        **llm_params
-    )
+def create_detailed_portfolio(
+    draft_portfolio,
+    detailed_plan,
+    model_name="gpt-4o",
+    llm_params=None,
+    outcome_detail=None
+):
+    prompt = detailed_prompt(draft_portfolio, detailed_plan, outcome_detail)
 
     # Generate the response using the prompt
-    response = llm(prompt)
+    response = create_llm(model_name, llm_params)(prompt)
+
+    return response
+
+
+async def acreate_detailed_portfolio(
+    draft_portfolio,
+    detailed_plan,
+    model_name="gpt-4o",
+    llm_params=None,
+    outcome_detail=None
+):
+    prompt = detailed_prompt(draft_portfolio, detailed_plan, outcome_detail)
+
+    # Generate the response without blocking the event loop
+    response = await create_llm(model_name, llm_params).ainvoke(prompt)
 
     return response
 
 
-def process_stocks(criteria):
+# Label of an investment type and the top_n rows of its metrics meeting the criteria of the draft
+# plan, with the criteria keys that could not be applied. Rows are None without screening data.
+def screen_rows(investment_type, criteria, top_n=5):
+    label, file_name = SCREENING_DATA[investment_type]
+    path = os.path.join(api_data_dir, file_name)
+    if not os.path.exists(path):
+        return label, None, []
+    rows, unsupported = screener.screen(screener.load_universe(path), criteria, top_n)
+    return label, rows, unsupported
+
+
+# Screen the metrics of an investment type with the criteria of the draft plan and describe the
+# top_n candidates for the detailed plan prompt. The rows are also recorded in `screened`
+# ({investment type: rows}) when given, for allocate_portfolio.
+def screen_assets(investment_type, criteria, top_n=5, screened=None):
+    label, rows, unsupported = screen_rows(investment_type, criteria, top_n)
+    if screened is not None:
+        screened[investment_type] = rows
+    if rows is None:
+        return f"No screening data available for {label} ({SCREENING_DATA[investment_type][1]} not found)."
+    return screener.describe_matches(label, rows, unsupported)
+
+
+# Risk models of the covariance directory and of its asset class subdirectories
+def load_risk_models(lookback=252):
+    directories = [
+        os.path.join(api_covariance_dir, file_name[len("summary_"):-len("_data.csv")])
+        for _, file_name in SCREENING_DATA.values()
+    ] + [api_covariance_dir]
+    return [
+        optimizer.load_risk_model(directory, lookback)
+        for directory in directories
+        if os.path.exists(os.path.join(directory, "index.json"))
+    ]
+
+
+# Weights of the screened candidates of every investment type of the draft, each type keeping the
+# allocation percentage of the draft. Returns a description per investment type for the detailed
+# plan prompt and the weight of every ticker. objective is one of optimizer.OBJECTIVES. The rows
+# already screened ({investment type: rows}, see screen_assets) are not screened again.
+def allocate_portfolio(criteria_list, objective, max_weight=0.25, top_n=5, screened=None):
+    models = load_risk_models()
+    if not models:
+        print(f"No covariance data in {api_covariance_dir}, skipping the {objective} allocation.")
+        return {}, {}
+
+    tickers = []
+    classes = []
+    budgets = []
+    for investment_type, criteria in criteria_list:
+        if screened is not None and investment_type in screened:
+            rows = screened[investment_type]
+        else:
+            _, rows, _ = screen_rows(investment_type, criteria, top_n)
+        try:
+            budget = float(str(criteria.get("allocation_percentage", 0)).strip().rstrip("%")) / 100
+        except ValueError:
+            budget = 0.0
+        tickers += [row["ticker"] for row in rows or []]
+        classes += [len(budgets)] * len(rows or [])
+        budgets.append(budget)
+
+    found, mean, covariance = optimizer.candidate_risk(models, tickers)
+    classes = np.array(classes, dtype=np.int64)[found]
+    budgets = np.array(budgets)
+    counts = np.bincount(classes, minlength=len(budgets))
+    # Types without candidates in the risk models keep their allocation out of the optimization
+    budgets = np.where(counts > 0, budgets, 0.0)
+    # Raise the cap of the types with too few candidates to hold their allocation
+    caps = np.maximum(max_weight, budgets / np.maximum(counts, 1))[classes]
+    weights = optimizer.optimize(mean, covariance, classes, budgets, objective, caps)
+
+    allocations = {}
+    portfolio = {}
+    for i, weight in zip(found, weights):
+        portfolio[tickers[i]] = portfolio.get(tickers[i], 0.0) + float(weight)
+    for k, (investment_type, _) in enumerate(criteria_list):
+        members = found[classes == k]
+        if len(members) == 0:
+            allocations[investment_type] = f"No {objective} allocation (no candidates with covariance data)."
+            continue
+        parts = [f"{tickers[i]} {100 * weight:.1f}%" for i, weight in zip(members, weights[classes == k])]
+        allocations[investment_type] = f"Optimized {objective} allocation (% of the portfolio): " + ", ".join(parts) + "."
+    return allocations, portfolio
+
+
+# Simulated value of budget_usd invested in a portfolio ({ticker: weight}) after
+# time_horizon_weeks, see simulator.simulate_plan. None without risk data for the tickers.
+def simulate_portfolio(portfolio, budget_usd, time_horizon_weeks, method="normal", paths=20000, seed=None):
+    models = load_risk_models()
+    tickers = list(portfolio)
+    found, mean, covariance = optimizer.candidate_risk(models, tickers)
+    if len(found) == 0:
+        return None
+    weights = np.array([portfolio[tickers[i]] for i in found])
+    returns = optimizer.candidate_returns(models, tickers) if method == "bootstrap" else None
+    if method == "bootstrap" and returns is None:
+        print("No stored returns and dates in the covariance data, simulating with the normal method.")
+        method = "normal"
+    return simulator.simulate_plan(
+        weights, time_horizon_weeks, budget_usd, paths, method, mean=mean, covariance=covariance, returns=returns, seed=seed
+    )
+
+
+# Optimized allocations of the draft added to the screening results, and a description of the
+# simulated outcomes of the optimized portfolio (None when the budget or horizon is unknown)
+def optimized_details(detailed_plan, criteria_list, objective, budget_usd, time_horizon_weeks, screened=None):
+    allocations, portfolio = allocate_portfolio(criteria_list, objective, screened=screened)
+    add_allocations(detailed_plan, allocations)
+    budget = profile_number(budget_usd)
+    weeks = profile_weeks(time_horizon_weeks)
+    if not portfolio or not budget or not weeks:
+        return None
+    outcomes = simulate_portfolio(portfolio, budget, weeks)
+    return simulator.describe_outcomes(outcomes) if outcomes is not None else None
+
+
+def process_stocks(criteria, screened=None):
     print("Processing Stocks with criteria:")
     for key, value in criteria.items():
         print(f"  {key}: {value}")
-    return "Recommended stocks are: GOOG, AMAZN, INTU and DAL"
+    return screen_assets("Stocks", criteria, screened=screened)
 
-def process_etfs(criteria):
+def process_etfs(criteria, screened=None):
     print("Processing ETFs with criteria:")
     for key, value in criteria.items():
         print(f"  {key}: {value}")
-    return "The good ETF candidates are: AIA.US, BOTZ.US"
+    return screen_assets("ETFs", criteria, screened=screened)
 
-def process_stock_indices(criteria):
+def process_stock_indices(criteria, screened=None):
     print("Processing Stock Indices with criteria:")
     for key, value in criteria.items():
         print(f"  {key}: {value}")
-    return "The good Stock Indices candidates are: SPA, QQQ"
+    return screen_assets("Stock Indices", criteria, screened=screened)
 
-def process_us_bonds(criteria):
+def process_us_bonds(criteria, screened=None):
     print("Processing US Bonds with criteria:")
     for key, value in criteria.items():
         print(f"  {key}: {value}")
-    return "Recommended bonds are: Treasury Bond 3 month"
+    return screen_assets("US Bonds", criteria, screened=screened)
 
-def process_crypto(criteria):
+def process_crypto(criteria, screened=None):
     print("Processing Crypto with criteria:")
     for key, value in criteria.items():
         print(f"  {key}: {value}")
-    return ""
+    return screen_assets("Crypto", criteria, screened=screened)
+
+
+# Define the investment types and their corresponding processing functions
+PROCESSING_FUNCTIONS = {
+    "Stocks": process_stocks,
+    "ETFs": process_etfs,
+    "Stock Indices": process_stock_indices,
+    "US Bonds": process_us_bonds,
+    "Crypto": process_crypto
+}
+
+
+# Criteria of every investment type of the draft portfolio, as (investment type, criteria)
+# pairs, or None when the draft is not valid JSON. Returns the cleaned draft as well.
+def draft_criteria(draft_portfolio):
+    # Remove backticks if they are present in the response
+    draft_portfolio = draft_portfolio.strip("```json\n").strip("```")
+
+    print("Draft plan is:", draft_portfolio)
+
+    # Parse the JSON string into a Python dictionary
+    try:
+        draft_portfolio_dict = json.loads(draft_portfolio)
+    except json.JSONDecodeError as e:
+        print("Error decoding JSON response.")
+        print(f"Raw JSON response: {draft_portfolio}")
+        return draft_portfolio, None
+
+    criteria_list = []
+    for investment_type, details in draft_portfolio_dict.items():
+        if investment_type in PROCESSING_FUNCTIONS:
+            # Extract criteria, excluding 'reason'
+            criteria = {key: value for key, value in details.items() if key != "reason"}
+            criteria_list.append((investment_type, criteria))
+    return draft_portfolio, criteria_list
+
+
+# Append the optimized allocation of every investment type to its screening result
+def add_allocations(detailed_plan, allocations):
+    for investment_type, allocation in allocations.items():
+        criteria, result = detailed_plan[investment_type]
+        detailed_plan[investment_type] = (criteria, f"{result} {allocation}")
+
+
+# Version of the screened market data: the modification times of the summary files, which the
+# daily data refresh rewrites
+def market_data_version():
+    version = []
+    for _, file_name in SCREENING_DATA.values():
+        path = os.path.join(api_data_dir, file_name)
+        version.append(os.stat(path).st_mtime_ns if os.path.exists(path) else None)
+    return tuple(version)
+
+
+def plan_cache_key(age, income, occupation, budget_usd, time_horizon_weeks, risk_level, asset_preference, liquidity, model_name, llm_params, objective=None):
+    return (
+        profile_key(age, income, occupation, budget_usd, time_horizon_weeks, risk_level, asset_preference, liquidity),
+        model_name,
+        json.dumps(llm_params or {}, sort_keys=True, default=repr),
+        objective,
+        market_data_version(),
+    )
+
+
+def cached_plan(cache_key, customer_name):
+    plan = plan_cache.get(cache_key, customer_name)
+    stats = plan_cache.stats()
+    print(f"Plan cache {'hit' if plan is not None else 'miss'} (hits {stats['hits']}, misses {stats['misses']})")
+    return plan
 
 
 def plan_investment(
@@ -175,18 +448,17 @@ def plan_investment(
     asset_preference,
     liquidity,
     model_name="gpt-4o",
-    llm_params=None
+    llm_params=None,
+    use_cache=True,
+    objective=None
 ):
-
-    # Define the investment types and their corresponding processing functions
-    investment_types = ["Stocks", "ETFs", "Stock Indices", "US Bonds", "Crypto"]
-    processing_functions = {
-        "Stocks": process_stocks,
-        "ETFs": process_etfs,
-        "Stock Indices": process_stock_indices,
-        "US Bonds": process_us_bonds,
-        "Crypto": process_crypto
-    }
+    if use_cache:
+        cache_key = plan_cache_key(
+            age, income, occupation, budget_usd, time_horizon_weeks, risk_level, asset_preference, liquidity, model_name, llm_params, objective
+        )
+        detailed_portfolio = cached_plan(cache_key, customer_name)
+        if detailed_portfolio is not None:
+            return detailed_portfolio
 
     # Generate the draft portfolio
     draft_portfolio = create_portfolio_draft(
@@ -203,46 +475,156 @@ def plan_investment(
         llm_params=llm_params
     )
 
-    # Remove backticks if they are present in the response
-    draft_portfolio = draft_portfolio.strip("```json\n").strip("```")
-
-    print("Draft plan is:", draft_portfolio)
-
-    # Parse the JSON string into a Python dictionary
-    try:
-        draft_portfolio_dict = json.loads(draft_portfolio)
-    except json.JSONDecodeError as e:
-        print("Error decoding JSON response.")
-        print(f"Raw JSON response: {draft_portfolio}")
+    draft_portfolio, criteria_list = draft_criteria(draft_portfolio)
+    if criteria_list is None:
         return None
 
     detailed_plan = {}
+    screened = {}
+    for investment_type, criteria in criteria_list:
+        result = PROCESSING_FUNCTIONS[investment_type](criteria, screened)  # Call the function with criteria as argument
+        detailed_plan[investment_type] = (criteria, result)
 
-    for investment_type, details in draft_portfolio_dict.items():
-        if investment_type in investment_types:
-            # Extract criteria, excluding 'reason'
-            criteria = {key: value for key, value in details.items() if key != "reason"}
-            
-            # Get the corresponding function based on the investment type
-            process_function = processing_functions.get(investment_type)
-            
-            if process_function:
-                result = process_function(criteria)  # Call the function with criteria as argument
-                detailed_plan[investment_type] = (criteria, result)
-            else:
-                print(f"No processing function defined for {investment_type}")
+    outcome_detail = None
+    if objective is not None:
+        outcome_detail = optimized_details(detailed_plan, criteria_list, objective, budget_usd, time_horizon_weeks, screened)
 
     detailed_portfolio = create_detailed_portfolio(
         draft_portfolio,
         detailed_plan,
         model_name=model_name,
+        llm_params=llm_params,
+        outcome_detail=outcome_detail
+    )
+
+    # Keep the structure of the plan for later updates
+    plan_updates.remember_plan(
+        str(getattr(detailed_portfolio, "content", detailed_portfolio)),
+        plan_updates.PlanState.from_draft(criteria_list, detailed_plan, ""),
+    )
+
+    if use_cache:
+        plan_cache.put(cache_key, detailed_portfolio, customer_name)
+
+    return detailed_portfolio
+
+
+# Same as plan_investment, with the LLM calls made through the async client and the investment
+# types screened concurrently in worker threads, so the plan waits for the slowest type instead
+# of the sum of all of them
+async def aplan_investment(
+    customer_name,
+    age,
+    income,
+    occupation,
+    budget_usd,
+    time_horizon_weeks,
+    risk_level,
+    asset_preference,
+    liquidity,
+    model_name="gpt-4o",
+    llm_params=None,
+    use_cache=True,
+    objective=None
+):
+    if use_cache:
+        cache_key = plan_cache_key(
+            age, income, occupation, budget_usd, time_horizon_weeks, risk_level, asset_preference, liquidity, model_name, llm_params, objective
+        )
+        detailed_portfolio = cached_plan(cache_key, customer_name)
+        if detailed_portfolio is not None:
+            return detailed_portfolio
+
+    # Generate the draft portfolio
+    draft_portfolio = await acreate_portfolio_draft(
+        customer_name,
+        age,
+        income,
+        occupation,
+        budget_usd,
+        time_horizon_weeks,
+        risk_level,
+        asset_preference,
+        liquidity,
+        model_name=model_name,
         llm_params=llm_params
     )
 
+    draft_portfolio, criteria_list = draft_criteria(draft_portfolio)
+    if criteria_list is None:
+        return None
+
+    screened = {}
+    results = await asyncio.gather(*[
+        asyncio.to_thread(PROCESSING_FUNCTIONS[investment_type], criteria, screened)
+        for investment_type, criteria in criteria_list
+    ])
+    detailed_plan = {
+        investment_type: (criteria, result)
+        for (investment_type, criteria), result in zip(criteria_list, results)
+    }
+
+    outcome_detail = None
+    if objective is not None:
+        # The optimization and simulation are CPU work: keep them off the event loop so that
+        # concurrent plans are not serialized behind them
+        outcome_detail = await asyncio.to_thread(
+            optimized_details, detailed_plan, criteria_list, objective, budget_usd, time_horizon_weeks, screened
+        )
+
+    detailed_portfolio = await acreate_detailed_portfolio(
+        draft_portfolio,
+        detailed_plan,
+        model_name=model_name,
+        llm_params=llm_params,
+        outcome_detail=outcome_detail
+    )
+
+    # Keep the structure of the plan for later updates
+    plan_updates.remember_plan(
+        str(getattr(detailed_portfolio, "content", detailed_portfolio)),
+        plan_updates.PlanState.from_draft(criteria_list, detailed_plan, ""),
+    )
+
+    if use_cache:
+        plan_cache.put(cache_key, detailed_portfolio, customer_name)
 
     return detailed_portfolio
 
 
+# Apply a change request to a plan with local edits (reweighting, substituting, removing or
+# re-screening an investment type), asking the model only to explain the change, or not at all
+# when narrate is False. None when the plan cannot be read or the change needs the full update.
+def structured_update(plan, change_to_apply, risk_level, time_horizon_weeks, model_name="gpt-4o", llm_params=None, narrate=True):
+    state = plan_updates.plan_state(plan)
+    if state is None:
+        return None
+    change = plan_updates.classify_change(change_to_apply)
+    updated = plan_updates.apply_change(state, change, screen_assets)
+    if updated is None:
+        return None
+    new_state, changed = updated
+    print(f"Applying the update locally ({change.kind})")
+
+    allocation_change = plan_updates.describe_allocations(state, new_state)
+    if narrate:
+        prompt_inputs = {
+            "risk_level": risk_level or "not provided",
+            "time_horizon_weeks": time_horizon_weeks or "not provided",
+            "new_requirement": change_to_apply,
+            "allocation_change": allocation_change,
+            "recommendations": "\n".join(f"{investment_type}: {new_state.screening[investment_type]}" for investment_type in changed),
+        }
+        prompt = render_prompt("update_delta_investment_plan.prompt", prompt_inputs)
+        narrative = create_llm(model_name, llm_params)(prompt).content
+    else:
+        narrative = f"Your plan was updated as requested: {change_to_apply}"
+
+    text = plan_updates.render_update(state, new_state, changed, narrative)
+    plan_updates.remember_plan(text, new_state)
+    return with_content(plan, lambda _: text)
+
+
 def update_investment(
     customer_name,
     age,
@@ -256,7 +638,9 @@ def update_investment(
     draft_plan,
     change_to_apply,
     model_name="gpt-4o",
-    llm_params=None
+    llm_params=None,
+    structured=True,
+    narrate=True
 ):
     print("The update requirement is:", change_to_apply)
 
@@ -264,13 +648,13 @@ def update_investment(
         print("Error, draft plan or change to apply is None, return plan with no changes.")
         return draft_plan        
 
-    if llm_params is None:
-        llm_params = {}
-
-    # Load the prompt from the prompt directory
-    prompt_file_path = os.path.join(api_prompt_dir, "update_investment_plan.prompt")
-    with open(prompt_file_path, "r") as prompt_file:
-        prompt_template = prompt_file.read()
+    # Small changes are applied locally, the model only explaining them
+    if structured:
+        updated_plan = structured_update(
+            draft_plan, change_to_apply, risk_level, time_horizon_weeks, model_name, llm_params, narrate
+        )
+        if updated_plan is not None:
+            return updated_plan
 
     # Prepare template inputs with 'not provided' only for debug visibility
     prompt_inputs = {
@@ -289,23 +673,9 @@ def update_investment(
         "day": datetime.datetime.now().strftime("%A"),
     }
 
-    # Use Jinja2 for better placeholder handling
-    template = Template(prompt_template)
-    prompt = template.render(**prompt_inputs)
-
-    # Check for unreplaced placeholders
-    unreplaced_placeholders = re.findall(r"\{\{(.*?)\}\}", prompt)
-    if unreplaced_placeholders:
-        print(f"Warning: The following placeholders were not replaced: {unreplaced_placeholders}")
-
-    # Instantiate the ChatOpenAI model
-    llm = ChatOpenAI(
-        model=model_name,
-        api_key=os.environ["OPENAI_API_KEY"],
-        **llm_params
-    )
+    prompt = render_prompt("update_investment_plan.prompt", prompt_inputs)
 
     # Generate the response using the prompt
-    response = llm(prompt)
+    response = create_llm(model_name, llm_params)(prompt)
 
-    return response
\ No newline at end of file
+    return response
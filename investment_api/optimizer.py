@@ -0,0 +1,224 @@
+import json
+import os
+
+import numpy as np
+
+OBJECTIVES = ["mean_variance", "min_variance", "risk_parity"]
+
+# Trading days per year, to annualize the daily means and covariances of data_script/covariance.py
+# when a risk model does not store its dates
+TRADING_DAYS = 252
+
+# Trade-off between annualized return and variance of the mean-variance objective
+RISK_AVERSION = 5.0
+
+ITERATIONS = 2000
+TOLERANCE = 1e-9
+
+
+# Tickers, daily mean returns, daily covariance and, when stored, the aligned daily returns
+# (dates x tickers) and their dates of one lookback written by data_script/covariance.py.
+# periods_per_year annualizes the daily statistics: the observations per year of the model's
+# calendar (about 252 for stocks, 365 for crypto traded every day), TRADING_DAYS without dates.
+class RiskModel:
+    def __init__(self, tickers, mean, covariance, returns=None, dates=None):
+        self.tickers = list(tickers)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.covariance = covariance
+        self.returns = returns
+        self.dates = dates
+        self.periods_per_year = observations_per_year(dates)
+        self.row_of = {ticker: row for row, ticker in enumerate(self.tickers)}
+
+    @classmethod
+    def load(cls, covariance_dir, lookback=252):
+        with open(os.path.join(covariance_dir, "index.json"), "r") as index_file:
+            entry = json.load(index_file)[str(lookback)]
+        mean = np.load(os.path.join(covariance_dir, f"mean_{lookback}.npy"))
+        covariance = np.load(os.path.join(covariance_dir, f"cov_{lookback}.npy"), mmap_mode="r")
+        returns_path = os.path.join(covariance_dir, f"returns_{lookback}.npy")
+        returns = np.load(returns_path, mmap_mode="r") if os.path.exists(returns_path) else None
+        dates = np.array(entry["dates"], dtype="datetime64[D]") if "dates" in entry else None
+        return cls(entry["tickers"], mean, covariance, returns, dates)
+
+
+# Daily observations per year of a calendar of return dates
+def observations_per_year(dates):
+    if dates is None or len(dates) < 2:
+        return TRADING_DAYS
+    days = (dates[-1] - dates[0]).astype("timedelta64[D]").astype(np.int64)
+    return (len(dates) - 1) * 365.25 / days if days > 0 else TRADING_DAYS
+
+
+# Risk models loaded from covariance directories, reloaded when a directory is rewritten
+_risk_models = {}
+
+
+def load_risk_model(covariance_dir, lookback=252):
+    mtime_ns = os.stat(os.path.join(covariance_dir, "index.json")).st_mtime_ns
+    key = (covariance_dir, lookback)
+    cached = _risk_models.get(key)
+    if cached is None or cached[0] != mtime_ns:
+        cached = (mtime_ns, RiskModel.load(covariance_dir, lookback))
+        _risk_models[key] = cached
+    return cached[1]
+
+
+# Annualized mean returns and covariance of the tickers found in the risk models, and the
+# positions of those tickers. Each model is annualized with its own observations per year.
+# Tickers of different models (e.g. one model per asset class) are taken as uncorrelated.
+def candidate_risk(models, tickers):
+    found = []
+    groups = []
+    for model in models:
+        positions = [i for i, ticker in enumerate(tickers) if ticker in model.row_of and i not in found]
+        if positions:
+            found += positions
+            groups.append((model, np.array([model.row_of[tickers[i]] for i in positions])))
+
+    mean = np.zeros(len(found))
+    covariance = np.zeros((len(found), len(found)))
+    offset = 0
+    for model, rows in groups:
+        block = slice(offset, offset + len(rows))
+        mean[block] = model.mean[rows] * model.periods_per_year
+        covariance[block, block] = np.asarray(model.covariance)[np.ix_(rows, rows)] * model.periods_per_year
+        offset += len(rows)
+    return np.array(found, dtype=np.int64), mean, covariance
+
+
+# Daily returns (dates x found tickers) of the tickers found in the risk models, in the order of
+# candidate_risk, on the dates all the models cover. The returns of a model's other dates (e.g.
+# the weekends of a crypto model) are compounded into the next common date, so every row holds
+# the same span of time for all the assets. Missing returns are 0. None when a model does not
+# store its returns and their dates.
+def candidate_returns(models, tickers):
+    blocks = []
+    found = set()
+    for model in models:
+        rows = [model.row_of[ticker] for i, ticker in enumerate(tickers) if ticker in model.row_of and i not in found]
+        found.update(i for i, ticker in enumerate(tickers) if ticker in model.row_of)
+        if rows:
+            if model.returns is None or model.dates is None:
+                return None
+            blocks.append((model.dates, np.asarray(model.returns)[:, rows]))
+    if not blocks:
+        return np.zeros((0, 0))
+
+    common = blocks[0][0]
+    for dates, _ in blocks[1:]:
+        common = np.intersect1d(common, dates)
+    aligned = []
+    for dates, returns in blocks:
+        growth = np.ones((len(common), returns.shape[1]))
+        position = np.searchsorted(common, dates)
+        # Dates before the first common date fall outside the common span
+        keep = (position < len(common)) & (dates >= common[0]) if len(common) else np.zeros(len(dates), dtype=bool)
+        daily = np.where(np.isnan(returns[keep]), 0.0, returns[keep]).astype(np.float64)
+        np.multiply.at(growth, position[keep], 1.0 + daily)
+        aligned.append(growth - 1.0)
+    return np.hstack(aligned)
+
+
+# Euclidean projection of v on {0 <= w <= max_weight, sum of w over each class = its budget}.
+# The class sums are piecewise linear in the threshold subtracted from v, with breakpoints at v and
+# v - max_weight, so one sort of the breakpoints of every class gives the exact thresholds.
+def project(v, classes, budgets, max_weight):
+    caps = np.broadcast_to(np.asarray(max_weight, dtype=np.float64), v.shape)
+    n_classes = len(budgets)
+    points = np.concatenate([v - caps, v])
+    owner = np.concatenate([classes, classes])
+    order = np.lexsort((points, owner))
+    points, owner = points[order], owner[order]
+    # Slope of the class sum just after each breakpoint
+    slope = np.cumsum(np.concatenate([-np.ones(len(v)), np.ones(len(v))])[order])
+    starts = np.zeros(n_classes, dtype=np.int64)
+    starts[1:] = np.cumsum(np.bincount(owner, minlength=n_classes))[:-1]
+    slope -= np.concatenate([[0.0], slope])[starts][owner]
+
+    # Class sum at each breakpoint, starting from the sum of the caps left of the first one
+    increments = np.zeros(len(points))
+    increments[1:] = slope[:-1] * np.diff(points)
+    first = np.zeros(len(points), dtype=bool)
+    first[starts[starts < len(points)]] = True
+    increments[first] = 0.0
+    totals = np.cumsum(increments)
+    totals -= np.concatenate([[0.0], totals])[starts][owner]
+    totals += np.bincount(classes, weights=caps, minlength=n_classes)[owner]
+
+    # Last breakpoint of each class at which the sum still reaches the budget
+    reached = np.bincount(owner, weights=totals >= budgets[owner] - 1e-15, minlength=n_classes).astype(np.int64)
+    last = np.minimum(starts + np.maximum(reached, 1) - 1, max(len(points) - 1, 0))
+    threshold = np.zeros(n_classes)
+    if len(points):
+        excess = totals[last] - budgets
+        with np.errstate(divide="ignore", invalid="ignore"):
+            threshold = np.where(slope[last] < 0, points[last] + excess / -slope[last], points[last])
+    return np.clip(v - threshold[classes], 0.0, caps)
+
+
+# Weights minimizing 1/2 w'Qw - c'w over the constraints, by accelerated projected gradient
+def projected_gradient(Q, c, classes, budgets, max_weight, iterations=ITERATIONS):
+    # The largest eigenvalue of Q gives the step
+    lipschitz = max(np.linalg.eigvalsh(Q)[-1], 1e-12) if len(Q) else 1.0
+    start = np.bincount(classes, minlength=len(budgets))[classes]
+    w = project(budgets[classes] / start, classes, budgets, max_weight)
+    y, momentum = w, 1.0
+    for _ in range(iterations):
+        previous = w
+        w = project(y - (Q @ y - c) / lipschitz, classes, budgets, max_weight)
+        if np.max(np.abs(w - previous), initial=0.0) < TOLERANCE:
+            break
+        # Restart the momentum when it stops pointing downhill
+        if np.dot(y - w, w - previous) > 0:
+            momentum = 1.0
+        next_momentum = (1 + np.sqrt(1 + 4 * momentum ** 2)) / 2
+        y = w + (momentum - 1) / next_momentum * (w - previous)
+        momentum = next_momentum
+    return w
+
+
+# Equal risk contribution weights of a covariance, summing to one: the minimum of
+# 1/2 y'Sy - sum(log y) by Newton's method, normalized
+def equal_risk_weights(covariance, iterations=50):
+    n = len(covariance)
+    y = 1 / np.sqrt(np.maximum(np.diag(covariance), 1e-12) * n)
+    for _ in range(iterations):
+        gradient = covariance @ y - 1 / y
+        step = np.linalg.solve(covariance + np.diag(1 / y ** 2), gradient)
+        # Damp the step so that the weights stay positive
+        scale = min(1.0, 0.9 / max(np.max(step / y), 1e-12))
+        y = y - scale * step
+        if np.max(np.abs(step / y)) < 1e-10:
+            break
+    return y / y.sum()
+
+
+# Weights of the assets under a budget per class (e.g. the allocation of each investment type of
+# the draft plan, as fractions of the portfolio) and a cap on every weight (a number or one cap
+# per asset).
+# mean and covariance are annualized; classes gives the class index of every asset.
+# risk_parity equalizes the risk contributions within each class.
+def optimize(mean, covariance, classes, budgets, objective="min_variance", max_weight=0.25, risk_aversion=RISK_AVERSION):
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective {objective!r}, expected one of {OBJECTIVES}")
+    classes = np.asarray(classes, dtype=np.int64)
+    budgets = np.asarray(budgets, dtype=np.float64)
+    counts = np.bincount(classes, minlength=len(budgets))
+    capacity = np.bincount(classes, weights=np.broadcast_to(max_weight, classes.shape), minlength=len(budgets))
+    infeasible = np.flatnonzero(capacity < budgets - 1e-12)
+    if len(infeasible):
+        raise ValueError(f"Classes {infeasible.tolist()} cannot reach their budget under the weight caps")
+
+    covariance = np.asarray(covariance, dtype=np.float64)
+    if objective == "mean_variance":
+        return projected_gradient(risk_aversion * covariance, np.asarray(mean, dtype=np.float64), classes, budgets, max_weight)
+    if objective == "min_variance":
+        return projected_gradient(covariance, np.zeros(len(classes)), classes, budgets, max_weight)
+
+    weights = np.zeros(len(classes))
+    for k in np.flatnonzero(counts):
+        members = np.flatnonzero(classes == k)
+        weights[members] = budgets[k] * equal_risk_weights(covariance[np.ix_(members, members)])
+    # Respect the cap, moving the excess to the other assets of the class
+    return project(weights, classes, budgets, max_weight)
@@ -0,0 +1,183 @@
+import bisect
+import copy
+import datetime
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Width in years of the age brackets of the cache key
+AGE_BRACKET = 10
+
+# Upper edges (USD) of the income bands of the cache key
+MONEY_BANDS = [1_000, 2_500, 5_000, 10_000, 25_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000]
+
+# Stands for the customer's name (and each part of it, e.g. the first name of a salutation) in
+# cached plans, so that a plan is never shown with another customer's name
+NAME_PLACEHOLDER = "[[customer_name]]"
+
+# A number and its magnitude suffix, which must stand alone: the "m" of "6 months" is not a million
+NUMBER_PATTERN = re.compile(r"(-?\d+(?:,\d{3})*(?:\.\d+)?)(?:\s*(k|thousand|m|mn|million|bn|billion)\b)?", re.IGNORECASE)
+MULTIPLIERS = {"k": 1e3, "thousand": 1e3, "m": 1e6, "mn": 1e6, "million": 1e6, "bn": 1e9, "billion": 1e9}
+
+# A duration and its unit; a bare number is in weeks
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(?:\s*(d|days?|w|wks?|weeks?|m|mos?|months?|y|yrs?|years?)\b)?", re.IGNORECASE)
+WEEKS_PER_UNIT = {"d": 1 / 7, "w": 1.0, "m": 52 / 12, "y": 52.0}
+
+
+# Number of a profile value given as a number or as text ("$50,000", "50k", "1.5 million",
+# "35 years"), or None. Words other than a magnitude are ignored.
+def profile_number(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = NUMBER_PATTERN.search(str(value or ""))
+    if match is None:
+        return None
+    multiplier = MULTIPLIERS.get((match.group(2) or "").lower(), 1)
+    return float(match.group(1).replace(",", "")) * multiplier
+
+
+# Weeks of a time horizon given as a number of weeks or as text ("26", "6 months", "2 years"), or None
+def profile_weeks(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = DURATION_PATTERN.search(str(value or ""))
+    if match is None:
+        return None
+    unit = (match.group(2) or "w")[0].lower()
+    return float(match.group(1)) * WEEKS_PER_UNIT[unit]
+
+
+def profile_text(value):
+    text = " ".join(str(value or "").lower().split())
+    return None if text in ("", "not provided", "none", "n/a") else text
+
+
+# Normalized asset preferences, in sorted order so that "stocks and bonds" is "bonds and stocks"
+def profile_preferences(value):
+    preferences = profile_text(value)
+    if preferences is None:
+        return None
+    return ",".join(sorted(filter(None, (p.strip() for p in re.split(r",|/|\band\b", preferences)))))
+
+
+# Exact profile value: its number when it has one, else its normalized text
+def profile_value(value, number_of=profile_number):
+    number = number_of(value)
+    return number if number is not None else profile_text(value)
+
+
+# Band a profile value falls in, its normalized text when it is not a number
+def profile_band(value, bands):
+    number = profile_number(value)
+    if number is None:
+        return profile_text(value)
+    return bisect.bisect_left(bands, number)
+
+
+# Normalized profile identifying the plans that can be shared between customers. Age and income
+# are bucketed; the budget and horizon are exact, as the plans quote them. The customer's name is
+# left out: it is swapped in and out of the cached plan instead.
+def profile_key(age, income, occupation, budget_usd, time_horizon_weeks, risk_level, asset_preference, liquidity):
+    age_number = profile_number(age)
+    return (
+        int(age_number // AGE_BRACKET) if age_number is not None else profile_text(age),
+        profile_band(income, MONEY_BANDS),
+        profile_text(occupation),
+        profile_value(budget_usd),
+        profile_value(time_horizon_weeks, profile_weeks),
+        profile_text(risk_level),
+        profile_preferences(asset_preference),
+        profile_text(liquidity),
+    )
+
+
+def next_refresh(now, refresh_hour):
+    refresh = now.replace(hour=refresh_hour, minute=0, second=0, microsecond=0)
+    return refresh if refresh > now else refresh + datetime.timedelta(days=1)
+
+
+# LRU cache of investment plans keyed by profile_key and the market data version. An entry
+# expires after ttl_seconds or at the next daily data refresh (refresh_hour, local time),
+# whichever comes first, as the plans quote the day's date and market data.
+class PlanCache:
+    def __init__(self, max_entries=256, ttl_seconds=24 * 3600, refresh_hour=0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.refresh_hour = refresh_hour
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Cached plan of the key with the customer's name filled in, or None
+    def get(self, key, customer_name=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return with_name(entry[1], customer_name)
+
+    def put(self, key, plan, customer_name=None):
+        plan = without_name(plan, customer_name)
+        now = time.time()
+        refresh = next_refresh(datetime.datetime.fromtimestamp(now), self.refresh_hour).timestamp()
+        with self._lock:
+            self._entries[key] = (min(now + self.ttl_seconds, refresh), plan)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# Plan with the customer's name replaced by NAME_PLACEHOLDER, to be shared with other customers:
+# the full name, then each of its parts ("Hi John" for John Smith), matched case-sensitively
+def without_name(plan, customer_name):
+    if not customer_name:
+        return plan
+    full_name = " ".join(str(customer_name).split())
+    parts = [part for part in re.split(r"[\s,]+", full_name) if len(part) > 1]
+    names = [full_name] + sorted(set(parts) - {full_name}, key=len, reverse=True)
+    name_pattern = re.compile("|".join(r"\b" + re.escape(name) + r"\b" for name in names))
+    return with_content(plan, lambda content: name_pattern.sub(NAME_PLACEHOLDER, content))
+
+
+# Shared plan with the customer's name filled in
+def with_name(plan, customer_name):
+    return with_content(plan, lambda content: content.replace(NAME_PLACEHOLDER, str(customer_name or "")))
+
+
+# Copy of a plan (a chat message or a string) with its text changed by `change`
+def with_content(plan, change):
+    if isinstance(plan, str):
+        return change(plan)
+    plan = copy.copy(plan)
+    plan.content = change(plan.content)
+    return plan
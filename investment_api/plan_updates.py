@@ -0,0 +1,306 @@
+import json
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+# Investment types of the draft plan and the words customers use for them, more specific first
+# so that "stock indices" is not read as "stocks"
+INVESTMENT_TYPES = [
+    ("Stock Indices", r"stock\s+indices|indices|indexes|index(?:\s+funds?)?"),
+    ("ETFs", r"etfs?|exchange[\s-]traded\s+funds?"),
+    ("US Bonds", r"(?:us\s+)?bonds?|treasur(?:y|ies)|fixed\s+income"),
+    ("Crypto", r"crypto(?:currenc(?:y|ies))?|bitcoin|ethereum"),
+    ("Stocks", r"stocks?|equit(?:y|ies)|shares"),
+]
+
+# Order of the investment types in plan texts
+PLAN_ORDER = ["Stocks", "ETFs", "Stock Indices", "US Bonds", "Crypto"]
+
+TYPE_PATTERN = "|".join(f"(?:{pattern})" for _, pattern in INVESTMENT_TYPES)
+TYPE_PATTERNS = [(investment_type, re.compile(rf"\b(?:{pattern})\b", re.IGNORECASE)) for investment_type, pattern in INVESTMENT_TYPES]
+
+PERCENT = r"(\d+(?:\.\d+)?)\s*%"
+# An explicit change in percentage points of the portfolio ("5 points", "5 percentage points", "5pp")
+POINTS = r"(\d+(?:\.\d+)?)\s*(?:pp|(?:percentage\s+)?points?)"
+
+# Words around an investment type that do not change the request
+FILLER = r"(?:(?:the|my|our|all|of|some|any)\s+)*"
+TYPE = rf"{FILLER}({TYPE_PATTERN})(?:\s+(?:allocation|holdings?|positions?|part|portion|share))?"
+
+# Polite openings and endings around a request
+REQUEST_FORMAT = r"(?:(?:please|kindly|(?:can|could|would)\s+you|i\s+want\s+to|i'?d\s+like\s+to|i\s+would\s+like\s+to|let'?s)\s+)*{}(?:\s+please)?[.!]?"
+
+
+def request_pattern(pattern):
+    return re.compile(REQUEST_FORMAT.format(pattern), re.IGNORECASE)
+
+
+# The structured edits, each matching a whole request of a single clause. Anything else (several
+# changes, negations, conditions, relative amounts such as "15% less" or "reduce bonds by 5%",
+# which may mean points of the portfolio or a share of the current allocation) is left to the
+# model.
+SET_PATTERN = request_pattern(
+    rf"(?:(?:set|put|make|change|adjust|bring|move|increase|raise|decrease|reduce|lower|cut)\s+)?{TYPE}\s+(?:to|at)\s+{PERCENT}"
+)
+BY_PATTERN = request_pattern(
+    rf"(increase|raise|boost|decrease|reduce|lower|cut)\s+{TYPE}\s+by\s+{POINTS}"
+)
+TAKE_PATTERN = request_pattern(rf"(?:take|remove|cut)\s+{POINTS}\s+(?:out\s+of|from|off)\s+{TYPE}")
+TRANSFER_PATTERN = request_pattern(
+    rf"(?:move|shift|transfer|reallocate|take)\s+{PERCENT}\s+(?:out\s+of|from)\s+{TYPE}\s+(?:to|into|in)\s+{TYPE}"
+)
+SUBSTITUTE_PATTERN = request_pattern(
+    rf"(?:swap|replace|switch|exchange|trade|move|shift)\s+(?:out\s+)?{TYPE}\s+(?:for|with|to|into)\s+{TYPE}"
+)
+INSTEAD_PATTERN = request_pattern(rf"(?:(?:use|buy|hold|invest\s+in)\s+)?{TYPE}\s+instead\s+of\s+{TYPE}")
+REMOVE_PATTERN = request_pattern(
+    rf"(?:remove|drop|exclude|sell(?:\s+off)?|get\s+rid\s+of|cut\s+out)\s+{TYPE}(?:\s+(?:entirely|completely|altogether))?"
+)
+RESCREEN_PATTERN = request_pattern(
+    rf"(?:(?:refresh|re-?screen|re-?select|change|update|pick|choose|find)\s+)?(?:new|different|other|better)?\s*{TYPE}\s+"
+    r"(?:picks?|selections?|candidates?|tickers?|choices?)"
+    rf"|(?:refresh|re-?screen|re-?select)\s+{TYPE}"
+)
+
+# Plan text followed by percentages, e.g. "Stocks (30%)" or "US Bonds: 25 %", in a detailed plan
+ALLOCATION_PATTERN = re.compile(rf"\b({TYPE_PATTERN})\b[^%\n]{{0,40}}?{PERCENT}", re.IGNORECASE)
+
+
+def investment_type_of(text):
+    for investment_type, pattern in TYPE_PATTERNS:
+        if pattern.fullmatch(text.strip()):
+            return investment_type
+    return None
+
+
+# Structured content of a generated plan: the allocation percentage, screening criteria and
+# screening result of each investment type, and the text shown to the customer
+@dataclass
+class PlanState:
+    allocations: dict
+    criteria: dict = field(default_factory=dict)
+    screening: dict = field(default_factory=dict)
+    text: str = ""
+
+    # State of a plan generated by plan_investment from the (investment type, criteria) pairs of
+    # the draft and its detailed plan ({investment type: (criteria, screening result)})
+    @classmethod
+    def from_draft(cls, criteria_list, detailed_plan, text):
+        allocations = {}
+        for investment_type, criteria in criteria_list:
+            try:
+                allocations[investment_type] = float(str(criteria.get("allocation_percentage", 0)).strip().rstrip("%"))
+            except ValueError:
+                allocations[investment_type] = 0.0
+        return cls(
+            allocations=allocations,
+            criteria={investment_type: dict(criteria) for investment_type, criteria in criteria_list},
+            screening={investment_type: result for investment_type, (_, result) in detailed_plan.items()},
+            text=text,
+        )
+
+    # State read back from the text of a plan: the JSON draft plan, or the first percentage
+    # following each investment type. None when the percentages found do not add up to a whole
+    # portfolio.
+    @classmethod
+    def parse(cls, text):
+        try:
+            draft = json.loads(text.strip().strip("`").removeprefix("json"))
+        except ValueError:
+            draft = None
+        if isinstance(draft, dict):
+            criteria_list = [
+                (investment_type, {key: value for key, value in details.items() if key != "reason"})
+                for investment_type, details in draft.items()
+                if investment_type in PLAN_ORDER and isinstance(details, dict)
+            ]
+            state = cls.from_draft(criteria_list, {}, text)
+            return state if abs(sum(state.allocations.values()) - 100) <= 1 else None
+
+        allocations = {}
+        for name, percentage in ALLOCATION_PATTERN.findall(text):
+            investment_type = investment_type_of(name)
+            if investment_type is not None and investment_type not in allocations:
+                allocations[investment_type] = float(percentage)
+        if not allocations or abs(sum(allocations.values()) - 100) > 1:
+            return None
+        # Types at 0% were removed by an earlier update
+        allocations = {name: value for name, value in allocations.items() if value > 0}
+        return cls(allocations=allocations, text=text)
+
+
+# A change request classified as one of:
+#   reweight (target to percentage, or by delta), transfer (delta from source to target),
+#   substitute (source for target), remove (source), rescreen (target), or other when no
+#   structured edit applies
+@dataclass
+class PlanChange:
+    kind: str
+    source: str = None
+    target: str = None
+    percentage: float = None
+    delta: float = None
+
+
+# Percentages are read as points of the whole portfolio: "set stocks to 30%" makes stocks 30% of
+# the portfolio and "move 10% from stocks to bonds" moves 10% of the portfolio. Changes by an
+# amount are only applied locally when given in points ("cut bonds by 5 points"), as "by 5%" may
+# also mean 5% of the current allocation.
+def classify_change(request):
+    request = " ".join(str(request).split())
+    match = SET_PATTERN.fullmatch(request)
+    if match:
+        return PlanChange("reweight", target=investment_type_of(match.group(1)), percentage=float(match.group(2)))
+    match = BY_PATTERN.fullmatch(request)
+    if match:
+        sign = 1 if match.group(1).lower() in ("increase", "raise", "boost") else -1
+        return PlanChange("reweight", target=investment_type_of(match.group(2)), delta=sign * float(match.group(3)))
+    match = TAKE_PATTERN.fullmatch(request)
+    if match:
+        return PlanChange("reweight", target=investment_type_of(match.group(2)), delta=-float(match.group(1)))
+    match = TRANSFER_PATTERN.fullmatch(request)
+    if match:
+        source, target = investment_type_of(match.group(2)), investment_type_of(match.group(3))
+        if source != target:
+            return PlanChange("transfer", source=source, target=target, delta=float(match.group(1)))
+        return PlanChange("other")
+    match = SUBSTITUTE_PATTERN.fullmatch(request)
+    if match:
+        source, target = investment_type_of(match.group(1)), investment_type_of(match.group(2))
+        return PlanChange("substitute", source=source, target=target) if source != target else PlanChange("other")
+    match = INSTEAD_PATTERN.fullmatch(request)
+    if match:
+        source, target = investment_type_of(match.group(2)), investment_type_of(match.group(1))
+        return PlanChange("substitute", source=source, target=target) if source != target else PlanChange("other")
+    match = REMOVE_PATTERN.fullmatch(request)
+    if match:
+        return PlanChange("remove", source=investment_type_of(match.group(1)))
+    match = RESCREEN_PATTERN.fullmatch(request)
+    if match:
+        return PlanChange("rescreen", target=investment_type_of(match.group(1) or match.group(2)))
+    return PlanChange("other")
+
+
+# Allocations with `investment_type` set to `percentage`, the other types scaled to fill the rest
+# of the portfolio. None when that is not possible.
+def rebalanced(allocations, investment_type, percentage):
+    if not 0 <= percentage <= 100:
+        return None
+    others = {name: value for name, value in allocations.items() if name != investment_type}
+    rest = sum(others.values())
+    if rest <= 0 and percentage < 100:
+        return None
+    scale = (100 - percentage) / rest if rest > 0 else 0.0
+    updated = {name: round(value * scale, 1) for name, value in others.items()}
+    if percentage > 0:
+        updated[investment_type] = percentage
+    return {name: value for name, value in updated.items() if value > 0}
+
+
+# Plan state after the change and the investment types that were screened for it, or None when
+# the change cannot be applied without the model. screen(investment_type, criteria) returns the
+# screening result of an investment type.
+def apply_change(state, change, screen):
+    allocations = dict(state.allocations)
+    criteria = dict(state.criteria)
+    screening = dict(state.screening)
+    changed = []
+
+    if change.kind == "reweight" and change.target is not None:
+        current = allocations.get(change.target, 0.0)
+        percentage = change.percentage if change.percentage is not None else current + change.delta
+        allocations = rebalanced(allocations, change.target, percentage)
+        changed = [change.target] if change.target not in state.allocations else []
+    elif change.kind == "transfer" and change.source in allocations and change.target is not None:
+        if not 0 < change.delta <= allocations[change.source]:
+            return None
+        allocations[change.source] = round(allocations[change.source] - change.delta, 1)
+        allocations[change.target] = allocations.get(change.target, 0.0) + change.delta
+        allocations = {name: value for name, value in allocations.items() if value > 0}
+        changed = [change.target] if change.target not in state.allocations else []
+    elif change.kind == "remove" and change.source in allocations:
+        allocations = rebalanced(allocations, change.source, 0.0)
+    elif change.kind == "substitute" and change.source in allocations and change.target is not None:
+        allocations[change.target] = allocations.get(change.target, 0.0) + allocations.pop(change.source)
+        changed = [change.target] if change.target not in state.allocations else []
+    elif change.kind == "rescreen" and change.target in allocations:
+        changed = [change.target]
+    else:
+        return None
+    if allocations is None:
+        return None
+
+    for investment_type in list(criteria):
+        if investment_type not in allocations:
+            criteria.pop(investment_type)
+            screening.pop(investment_type, None)
+    for investment_type in changed:
+        criteria.setdefault(investment_type, {})
+        screening[investment_type] = screen(investment_type, criteria[investment_type])
+    return PlanState(allocations=allocations, criteria=criteria, screening=screening), changed
+
+
+# Allocation lines of the updated plan, with the previous percentage of the types that changed
+def describe_allocations(old_state, new_state):
+    lines = []
+    for investment_type in PLAN_ORDER:
+        old = old_state.allocations.get(investment_type)
+        new = new_state.allocations.get(investment_type)
+        if new is None and old is None:
+            continue
+        line = f"- {investment_type}: {new or 0:g}%"
+        if old != new:
+            line += f" (was {old or 0:g}%)"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+# Text of a plan with the allocation percentage of every investment type (the first percentage
+# following it, as read by PlanState.parse, when it is the old allocation) replaced by the new
+# one, 0 for a removed type
+def patch_allocations(text, old_allocations, allocations):
+    pieces = []
+    position = 0
+    patched = set()
+    for match in ALLOCATION_PATTERN.finditer(text):
+        investment_type = investment_type_of(match.group(1))
+        if investment_type is None or investment_type in patched:
+            continue
+        patched.add(investment_type)
+        if investment_type not in old_allocations or abs(float(match.group(2)) - old_allocations[investment_type]) > 0.05:
+            continue
+        pieces += [text[position:match.start(2)], f"{allocations.get(investment_type, 0):g}"]
+        position = match.end(2)
+    return "".join(pieces) + text[position:]
+
+
+# Text of the updated plan: the previous plan with its allocation percentages patched, followed
+# by the narrative of the change, the allocation and the recommendations of the investment types
+# that were screened again
+def render_update(old_state, new_state, changed, narrative):
+    text = patch_allocations(old_state.text, old_state.allocations, new_state.allocations).rstrip()
+    text += f"\n\nUpdate: {narrative}\n\nUpdated allocation:\n{describe_allocations(old_state, new_state)}"
+    for investment_type in changed:
+        text += f"\n\n{investment_type} (updated recommendations): {new_state.screening[investment_type]}"
+    return text.lstrip()
+
+
+# States of the plans generated or updated recently, by plan text
+_plan_states = OrderedDict()
+MAX_PLAN_STATES = 256
+
+
+def remember_plan(text, state):
+    state.text = text
+    _plan_states[text] = state
+    _plan_states.move_to_end(text)
+    while len(_plan_states) > MAX_PLAN_STATES:
+        _plan_states.popitem(last=False)
+
+
+# State of a plan given as a plan_investment result or its text: the state recorded when it was
+# generated, else the one parsed from its text
+def plan_state(plan):
+    text = str(getattr(plan, "content", plan))
+    state = _plan_states.get(text)
+    return state if state is not None else PlanState.parse(text)
@@ -0,0 +1,205 @@
+import functools
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# Criteria keys of the draft plan that name a metric column without matching it exactly
+CRITERIA_COLUMNS = {
+    "rsi_criteria": "rsi",
+    "macd_criteria": "macd",
+    "signal_criteria": "signal_line",
+}
+
+# Phrases and symbols of a comparison, longest first so that "greater than or equal to" is not
+# read as "greater than"
+OPERATORS = [
+    ("greater than or equal to", ">="),
+    ("less than or equal to", "<="),
+    ("greater than", ">"),
+    ("higher than", ">"),
+    ("more than", ">"),
+    ("less than", "<"),
+    ("lower than", "<"),
+    ("at least", ">="),
+    ("at most", "<="),
+    ("above", ">"),
+    ("over", ">"),
+    ("below", "<"),
+    ("under", "<"),
+    (">=", ">="),
+    ("<=", "<="),
+    (">", ">"),
+    ("<", "<"),
+]
+
+OPERATOR_OF = dict(OPERATORS)
+
+COMPARE = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+}
+
+NUMBER = r"\$?\s*(-?\d+(?:,\d{3})*(?:\.\d+)?)\s*(%?)"
+
+COMPARISON_PATTERN = re.compile(
+    "(" + "|".join(re.escape(phrase) for phrase, _ in OPERATORS) + r")\s*" + NUMBER, re.IGNORECASE
+)
+BETWEEN_PATTERN = re.compile(r"between\s+" + NUMBER + r"\s+and\s+" + NUMBER, re.IGNORECASE)
+SIGN_PATTERN = re.compile(r"\b(positive|negative)\b", re.IGNORECASE)
+
+
+# Metrics of one asset class held as column arrays, with lowercase column names as in the SUQL
+# tables. Screening a criteria dict is a handful of vectorized comparisons over these arrays.
+class Universe:
+    def __init__(self, tickers, columns):
+        self.tickers = np.asarray(tickers, dtype=object)
+        self.columns = {name: np.asarray(values, dtype=np.float64) for name, values in columns.items()}
+
+    def __len__(self):
+        return len(self.tickers)
+
+    @classmethod
+    def from_frame(cls, df):
+        df = df.rename(columns=str.lower)
+        columns = {name: pd.to_numeric(df[name], errors="coerce") for name in df.columns if name not in ("ticker", "_id")}
+        return cls(df["ticker"].to_numpy(), columns)
+
+    # Summary CSV written by data_script/us_stock_processing.py
+    @classmethod
+    def from_csv(cls, path):
+        return cls.from_frame(pd.read_csv(path))
+
+    # Metrics table loaded by data_script/db_loader.py, read over an open psycopg2 connection
+    @classmethod
+    def from_table(cls, conn, table_name):
+        from psycopg2 import sql
+
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("SELECT * FROM {}").format(sql.Identifier(table_name)))
+            names = [column.name for column in cursor.description]
+            return cls.from_frame(pd.DataFrame(cursor.fetchall(), columns=names))
+
+
+# Column a criteria key refers to, or None when the metrics have no such column
+def criterion_column(key, columns):
+    key = key.lower()
+    column = CRITERIA_COLUMNS.get(key, key)
+    return column if column in columns else None
+
+
+def criterion_value(number, percent, column):
+    value = float(number.replace(",", ""))
+    # Volatilities are stored as fractions, returns as percentages
+    if percent and column.endswith("_volatility"):
+        value /= 100
+    return value
+
+
+# Conditions (column, operator, value) of one criterion of the draft plan, e.g.
+# ("5_day_return", "greater than 1.2%") -> (("5_day_return", ">", 1.2),)
+# "RSI > 55, indicating ..." -> (("rsi", ">", 55.0),), "MACD is positive" -> (("macd", ">", 0.0),)
+# Text without a recognizable bound ("N/A", "no specific limit") gives no conditions.
+@functools.lru_cache(maxsize=4096)
+def parse_criterion(column, text):
+    text = str(text)
+    conditions = []
+    for low, low_percent, high, high_percent in BETWEEN_PATTERN.findall(text):
+        conditions.append((column, ">=", criterion_value(low, low_percent, column)))
+        conditions.append((column, "<=", criterion_value(high, high_percent, column)))
+    text = BETWEEN_PATTERN.sub("", text)
+
+    for phrase, number, percent in COMPARISON_PATTERN.findall(text):
+        conditions.append((column, OPERATOR_OF[phrase.lower()], criterion_value(number, percent, column)))
+
+    if not conditions:
+        for sign in SIGN_PATTERN.findall(text):
+            conditions.append((column, ">" if sign.lower() == "positive" else "<", 0.0))
+    return tuple(conditions)
+
+
+# Conditions of a criteria dict and the keys that could not be applied to the metrics
+def compile_criteria(criteria, columns):
+    conditions = []
+    unsupported = []
+    for key, text in criteria.items():
+        if key in ("allocation_percentage", "reason"):
+            continue
+        column = criterion_column(key, columns)
+        parsed = parse_criterion(column, str(text)) if column is not None else ()
+        if column is None and not re.fullmatch(r"\s*(n/?a|none)?\s*", str(text), re.IGNORECASE):
+            unsupported.append(key)
+        conditions.extend(parsed)
+    return conditions, unsupported
+
+
+# Boolean mask of the tickers meeting every condition. Missing (NaN) metrics fail.
+def screen_mask(universe, conditions):
+    mask = np.ones(len(universe), dtype=bool)
+    for column, operator, value in conditions:
+        mask &= COMPARE[operator](universe.columns[column], value)
+    return mask
+
+
+# Return column used to rank the matches: the shortest horizon the criteria constrain, as it
+# reflects the customer's time horizon, else the 1-month return
+def rank_column(conditions, columns):
+    for horizon in ("5_day", "10_day", "1_month", "6_month", "1_year"):
+        if any(column.startswith(horizon) for column, _, _ in conditions) and f"{horizon}_return" in columns:
+            return f"{horizon}_return"
+    return "1_month_return" if "1_month_return" in columns else None
+
+
+# The top_n tickers meeting the criteria, best first, as dicts holding the ticker and the columns
+# the criteria used and the ranking column. Also returns the criteria keys that could not be applied.
+def screen(universe, criteria, top_n=5):
+    conditions, unsupported = compile_criteria(criteria, universe.columns)
+    matches = np.flatnonzero(screen_mask(universe, conditions))
+
+    rank_by = rank_column(conditions, universe.columns)
+    if rank_by is not None and len(matches) > 0:
+        scores = universe.columns[rank_by][matches]
+        scores = np.where(np.isnan(scores), -np.inf, scores)
+        if len(matches) > top_n:
+            best = np.argpartition(-scores, top_n - 1)[:top_n]
+            matches, scores = matches[best], scores[best]
+        matches = matches[np.argsort(-scores, kind="stable")]
+    matches = matches[:top_n]
+
+    used = list(dict.fromkeys([column for column, _, _ in conditions] + ([rank_by] if rank_by else [])))
+    rows = [
+        dict([("ticker", universe.tickers[row])] + [(column, float(universe.columns[column][row])) for column in used])
+        for row in matches
+    ]
+    return rows, unsupported
+
+
+# Universes loaded from summary CSV files, reloaded when a file changes
+_universes = {}
+
+
+def load_universe(path):
+    mtime_ns = os.stat(path).st_mtime_ns
+    cached = _universes.get(path)
+    if cached is None or cached[0] != mtime_ns:
+        cached = (mtime_ns, Universe.from_csv(path))
+        _universes[path] = cached
+    return cached[1]
+
+
+# One-line description of the screening result for the detailed plan prompt
+def describe_matches(label, rows, unsupported):
+    if len(rows) == 0:
+        text = f"No {label} meet all the criteria."
+    else:
+        metrics = [
+            f"{row['ticker']} (" + ", ".join(f"{name} {value:.4g}" for name, value in list(row.items())[1:]) + ")"
+            for row in rows
+        ]
+        text = f"The best {label} candidates are: " + "; ".join(metrics)
+    if unsupported:
+        text += f" Criteria not applied (no matching data): {', '.join(unsupported)}."
+    return text
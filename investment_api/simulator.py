@@ -0,0 +1,103 @@
+import numpy as np
+
+from investment_api.optimizer import TRADING_DAYS
+
+METHODS = ["normal", "bootstrap"]
+
+PERCENTILES = [5, 25, 50, 75, 95]
+
+# Trading days per week of the horizon
+WEEK_DAYS = 5
+
+# Longest horizon simulated, in weeks
+MAX_WEEKS = 520
+
+# Bounds on the simulated path-days: in total (the paths of long horizons are reduced to fit) and
+# per block of paths held in memory at once
+MAX_PATH_DAYS = 10_000_000
+BLOCK_PATH_DAYS = 1_000_000
+
+
+# Daily returns of the portfolio on every path, as a (paths x days) matrix. The weights are kept
+# constant (rebalanced daily) and the part of the budget they leave out is held in cash.
+# normal draws the daily returns of the assets from a multivariate normal with the mean and
+# covariance (annualized, as given by optimizer.candidate_risk), which makes the portfolio return
+# normal with mean w'm and variance w'Sw. bootstrap resamples whole days of the historical returns
+# (dates x assets), keeping the co-movement of the assets on each day.
+# seed is a seed or a numpy Generator.
+def portfolio_paths(weights, days, paths, method="normal", mean=None, covariance=None, returns=None, seed=None):
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}")
+    rng = np.random.default_rng(seed)
+    weights = np.asarray(weights, dtype=np.float64)
+    if method == "normal":
+        daily_mean = float(weights @ np.asarray(mean, dtype=np.float64)) / TRADING_DAYS
+        daily_std = np.sqrt(max(float(weights @ np.asarray(covariance, dtype=np.float64) @ weights), 0.0) / TRADING_DAYS)
+        return daily_mean + daily_std * rng.standard_normal((paths, days))
+
+    history = np.asarray(returns, dtype=np.float64) @ weights
+    if len(history) == 0:
+        raise ValueError("No historical returns to resample")
+    return history[rng.integers(0, len(history), size=(paths, days))]
+
+
+# Distribution of the value of a budget invested in the portfolio after time_horizon_weeks:
+# percentiles of the final value, expected value, probability of a loss and percentiles of the
+# maximum drawdown along the way, over `paths` simulated paths. The horizon is clamped to
+# MAX_WEEKS and the paths to MAX_PATH_DAYS path-days; the paths are simulated BLOCK_PATH_DAYS
+# path-days at a time, so memory stays bounded whatever the horizon.
+def simulate_plan(
+    weights,
+    time_horizon_weeks,
+    budget_usd,
+    paths=20000,
+    method="normal",
+    mean=None,
+    covariance=None,
+    returns=None,
+    seed=None,
+):
+    weeks = min(max(float(time_horizon_weeks), 0.0), MAX_WEEKS)
+    days = max(int(round(weeks * WEEK_DAYS)), 1)
+    paths = max(min(int(paths), MAX_PATH_DAYS // days), 1)
+    rng = np.random.default_rng(seed)
+    block = max(BLOCK_PATH_DAYS // days, 1)
+
+    final = np.empty(paths)
+    max_drawdown = np.empty(paths)
+    for first in range(0, paths, block):
+        count = min(block, paths - first)
+        daily = portfolio_paths(weights, days, count, method, mean, covariance, returns, rng)
+        # Values are computed in place, as growth factors of the budget, and the running peak in a
+        # second buffer that then holds the drawdowns
+        values = np.cumprod(np.maximum(1.0 + daily, 0.0, out=daily), axis=1, out=daily)
+        peak = np.maximum.accumulate(values, axis=1)
+        np.maximum(peak, 1.0, out=peak)
+        np.divide(values, peak, out=peak)
+        final[first:first + count] = values[:, -1] * budget_usd
+        max_drawdown[first:first + count] = 1.0 - peak.min(axis=1)
+
+    return {
+        "days": days,
+        "paths": paths,
+        "method": method,
+        "budget_usd": float(budget_usd),
+        "expected_value": float(final.mean()),
+        "value_percentiles": dict(zip(PERCENTILES, np.percentile(final, PERCENTILES).tolist())),
+        "probability_of_loss": float(np.mean(final < budget_usd)),
+        "max_drawdown_percentiles": dict(zip(PERCENTILES, np.percentile(max_drawdown, PERCENTILES).tolist())),
+    }
+
+
+# Plain description of simulated outcomes for the detailed plan prompt
+def describe_outcomes(outcomes):
+    values = outcomes["value_percentiles"]
+    drawdowns = outcomes["max_drawdown_percentiles"]
+    weeks = outcomes["days"] / WEEK_DAYS
+    return (
+        f"Over {weeks:g} weeks, ${outcomes['budget_usd']:,.0f} invested would most likely be worth about "
+        f"${values[50]:,.0f} (90% of {outcomes['paths']:,} simulated outcomes between ${values[5]:,.0f} and "
+        f"${values[95]:,.0f}; expected ${outcomes['expected_value']:,.0f}). "
+        f"Probability of ending with a loss: {100 * outcomes['probability_of_loss']:.0f}%. "
+        f"Typical largest drop along the way: {100 * drawdowns[50]:.1f}% (1 in 20 paths: {100 * drawdowns[95]:.1f}% or more)."
+    )
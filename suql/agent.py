@@ -241,8 +241,10 @@ def postprocess_suql(suql_query):
     In the `stocks` context, we post-process a generated SUQL query with:
     (1) Escape single quotes in the query.
     (2) Ensure all generated queries include a LIMIT clause (default: LIMIT 3).
-    (3) Cast `MONEY` fields to `NUMERIC` for numeric operations.
-    (4) Handle other fields stored as TEXT appropriately.
+
+    The metric columns of `stocks` and `etfs` are DOUBLE PRECISION (see
+    data_script/db_loader.py), so comparisons are left as generated and can use
+    the B-tree indexes on those columns.
     """
 
     # Escape single quotes for PostgreSQL
@@ -252,63 +254,6 @@ def postprocess_suql(suql_query):
     if "LIMIT" not in suql_query:
         suql_query = re.sub(r";$", " LIMIT 3;", suql_query, flags=re.MULTILINE)
 
-    # Process MONEY fields to allow numeric comparisons
-    def process_money_casts(suql_query_):
-        """
-        Ensure proper casting of MONEY fields like `5_day_return` or others.
-        """
-        money_fields = [
-            "5_day_return",
-            "10_day_return",
-            "1_month_return",
-            "6_month_return",
-            "1_year_return",
-        ]
-
-        for field in money_fields:
-            pattern = rf'({field})\s*(>=|<=|>|<|=)\s*([\d\.]+)'
-            suql_query_ = re.sub(pattern, r"CAST(\1 AS NUMERIC) \2 \3", suql_query_)
-
-        return suql_query_
-
-    # Ensure TEXT fields are handled as strings
-    def process_text_fields(suql_query_):
-        """
-        Ensure proper handling of TEXT fields in the query.
-        Wraps conditions on TEXT fields in single quotes if not already present.
-        """
-        text_fields = [
-            "5_day_avg_close",
-            "5_day_volatility",
-            "5_day_avg_volume",
-            "10_day_avg_close",
-            "10_day_volatility",
-            "10_day_avg_volume",
-            "1_month_avg_close",
-            "1_month_volatility",
-            "1_month_avg_volume",
-            "6_month_avg_close",
-            "6_month_volatility",
-            "6_month_avg_volume",
-            "1_year_avg_close",
-            "1_year_volatility",
-            "1_year_avg_volume",
-            "rsi",
-            "macd",
-            "signal_line",
-        ]
-
-        for field in text_fields:
-            # Match patterns like `field = value` or `field != value` and ensure value is quoted
-            pattern = rf'({field})\s*(=|!=)\s*([^\'"\s]+)'
-            suql_query_ = re.sub(pattern, r"\1 \2 '\3'", suql_query_)
-
-        return suql_query_
-
-    # Apply processing
-    suql_query = process_money_casts(suql_query)
-    suql_query = process_text_fields(suql_query)
-
     return suql_query
 
 
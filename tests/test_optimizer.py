@@ -0,0 +1,26 @@
+import numpy as np
+
+from investment_api.optimizer import TRADING_DAYS, RiskModel, candidate_risk
+
+
+def daily_model(ticker, dates):
+    return RiskModel([ticker], [0.001], np.array([[0.0004]]), dates=dates)
+
+
+def test_models_annualize_with_their_own_calendar():
+    stock_dates = np.busday_offset("2023-01-02", np.arange(521), roll="forward")
+    crypto_dates = np.arange(np.datetime64("2023-01-02"), np.datetime64("2025-01-01"))
+    stocks = daily_model("SPY.US", stock_dates)
+    crypto = daily_model("BTC.V", crypto_dates)
+
+    _, mean, covariance = candidate_risk([stocks, crypto], ["SPY.US", "BTC.V"])
+
+    assert abs(mean[0] / 0.001 - 260) < 2
+    assert abs(mean[1] / 0.001 - 365.25) < 1
+    np.testing.assert_allclose(np.diag(covariance) / 0.0004, mean / 0.001)
+
+
+def test_models_without_dates_annualize_with_trading_days():
+    _, mean, covariance = candidate_risk([daily_model("SPY.US", None)], ["SPY.US"])
+    np.testing.assert_allclose(mean, [0.001 * TRADING_DAYS])
+    np.testing.assert_allclose(covariance, [[0.0004 * TRADING_DAYS]])
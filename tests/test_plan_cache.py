@@ -0,0 +1,33 @@
+from investment_api.plan_cache import PlanCache, profile_key, profile_number, profile_weeks
+
+PROFILE = dict(
+    age=34,
+    income="$80,000",
+    occupation="Engineer",
+    budget_usd="$30,000",
+    time_horizon_weeks="20",
+    risk_level="Medium",
+    asset_preference="stocks and bonds",
+    liquidity="high",
+)
+
+
+def test_profile_numbers_read_magnitudes_not_units():
+    assert profile_number("50k") == 50_000
+    assert profile_number("1.5 million") == 1_500_000
+    assert profile_number("6 months") == 6
+    assert profile_weeks("6 months") == 26
+    assert profile_weeks("2 years") == 104
+    assert profile_weeks("26") == 26
+
+
+def test_same_band_different_horizons_do_not_share_plans():
+    assert profile_key(**PROFILE) == profile_key(**dict(PROFILE, age=36, occupation="engineer", time_horizon_weeks="20 weeks"))
+    assert profile_key(**PROFILE) != profile_key(**dict(PROFILE, time_horizon_weeks="26"))
+    assert profile_key(**PROFILE) != profile_key(**dict(PROFILE, budget_usd="$35,000"))
+
+
+def test_cached_plan_never_shows_another_customers_name():
+    cache = PlanCache()
+    cache.put("key", "Hi John, here is the plan for John Smith.", "John Smith")
+    assert cache.get("key", "Ann Lee") == "Hi Ann Lee, here is the plan for Ann Lee."
@@ -0,0 +1,101 @@
+import pytest
+
+from investment_api.plan_updates import PlanChange, PlanState, apply_change, classify_change, render_update
+
+ALLOCATIONS = {"Stocks": 40.0, "ETFs": 30.0, "US Bonds": 20.0, "Crypto": 10.0}
+
+PLAN_TEXT = """Dear Ann, here is your plan.
+## Stocks (40%)
+Buy AAPL and MSFT. Stocks returned 12% last month.
+## ETFs: 30%
+SPY and QQQ.
+## US Bonds - 20%
+TLT.
+## Crypto (10%)
+BTC."""
+
+
+def screen(investment_type, criteria):
+    return f"new {investment_type} picks"
+
+
+def applied(request, allocations=ALLOCATIONS):
+    updated = apply_change(PlanState(allocations=dict(allocations)), classify_change(request), screen)
+    return None if updated is None else updated[0].allocations
+
+
+@pytest.mark.parametrize(
+    "request_text, change",
+    [
+        ("Set stocks to 30%", PlanChange("reweight", target="Stocks", percentage=30.0)),
+        ("put my crypto at 5%.", PlanChange("reweight", target="Crypto", percentage=5.0)),
+        ("Change the stocks allocation to 25%", PlanChange("reweight", target="Stocks", percentage=25.0)),
+        ("Please reduce bonds by 5 percentage points", PlanChange("reweight", target="US Bonds", delta=-5.0)),
+        ("increase crypto by 5 points please", PlanChange("reweight", target="Crypto", delta=5.0)),
+        ("take 5pp out of crypto", PlanChange("reweight", target="Crypto", delta=-5.0)),
+        ("Move 10% from stocks to bonds", PlanChange("transfer", source="Stocks", target="US Bonds", delta=10.0)),
+        ("Replace my ETFs with stock indices", PlanChange("substitute", source="ETFs", target="Stock Indices")),
+        ("I'd like to swap stocks for bonds", PlanChange("substitute", source="Stocks", target="US Bonds")),
+        ("Use ETFs instead of stocks", PlanChange("substitute", source="Stocks", target="ETFs")),
+        ("Drop all of my crypto please", PlanChange("remove", source="Crypto")),
+        ("Refresh my stock picks", PlanChange("rescreen", target="Stocks")),
+        ("re-screen crypto", PlanChange("rescreen", target="Crypto")),
+    ],
+)
+def test_classify_structured_requests(request_text, change):
+    assert classify_change(request_text) == change
+
+
+@pytest.mark.parametrize(
+    "request_text",
+    [
+        # Relative amounts: percentage points or a share of the current allocation
+        "I want 15% less in stocks",
+        "Please reduce bonds by 5%",
+        "increase crypto by 5 % please",
+        "take 5% out of crypto",
+        # Several changes
+        "Increase stocks to 40% and reduce bonds by 10%",
+        "Remove crypto, then set stocks to 50%",
+        # Negations and conditions
+        "Don't remove my stocks, just lower crypto to 5%",
+        "Do not sell my bonds",
+        "Set stocks to 30% if the market drops",
+        "no more crypto",
+        # Not a plan edit
+        "Make my plan more conservative",
+        "Move 10% from stocks to stocks",
+    ],
+)
+def test_classify_ambiguous_requests_as_other(request_text):
+    assert classify_change(request_text).kind == "other"
+
+
+def test_transfer_moves_only_between_the_two_types():
+    assert applied("Move 10% from stocks to bonds") == {"Stocks": 30.0, "ETFs": 30.0, "US Bonds": 30.0, "Crypto": 10.0}
+
+
+def test_transfer_of_more_than_the_source_needs_the_model():
+    assert applied("Move 50% from crypto to stocks") is None
+
+
+def test_reweight_scales_the_other_types():
+    assert applied("take 5 points out of crypto") == {"Stocks": 42.2, "ETFs": 31.7, "US Bonds": 21.1, "Crypto": 5.0}
+    assert applied("Set stocks to 30%") == {"ETFs": 35.0, "US Bonds": 23.3, "Crypto": 11.7, "Stocks": 30.0}
+
+
+def test_reweight_below_zero_needs_the_model():
+    assert applied("reduce crypto by 20 points") is None
+
+
+def test_update_keeps_the_rest_of_the_plan():
+    state = PlanState.parse(PLAN_TEXT)
+    assert state.allocations == ALLOCATIONS
+
+    new_state, changed = apply_change(state, classify_change("Replace crypto with stock indices"), screen)
+    text = render_update(state, new_state, changed, "Crypto was replaced by stock indices.")
+
+    assert text.startswith("Dear Ann, here is your plan.\n## Stocks (40%)\nBuy AAPL and MSFT. Stocks returned 12% last month.")
+    assert "## Crypto (0%)" in text
+    assert "Stock Indices (updated recommendations): new Stock Indices picks" in text
+    assert PlanState.parse(text).allocations == {"Stocks": 40.0, "ETFs": 30.0, "US Bonds": 20.0, "Stock Indices": 10.0}